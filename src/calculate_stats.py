@@ -20,6 +20,8 @@ def subset_result(result_dir, f_names):
     result, num_rejects, f_name2result, f_name2gold = [], defaultdict(int), {}, {}
     num_searches, num_compile_errors = 0, 0
     num_no_candidates = 0
+    # stage of the rejection cascade -> summed statistics, see evals/cascade.py
+    stage_stats = {}
     for f_name in f_names:
         search_result_dir = result_dir + f_name + '.pkl'
         if not os.path.exists(search_result_dir):
@@ -44,13 +46,21 @@ def subset_result(result_dir, f_names):
                         f_name2result[f_name] = _['rank']
                         passed = True
                         break
-                    elif _['status'] in ('Compilation Error', 'braces rejected'):
+                    elif _['status'] in ('Compilation Error', 'braces rejected', 'pseudo compile rejected'):
                         num_compile_errors += 1
                 if not passed:
                     result.append(-1)
                     f_name2result[f_name] = -1
                 elif 'bracket_rej' in d[-1]:
                     num_rejects[d[-1]['bracket_rej']] += 1
+                search_stats_dir = result_dir + f_name + '.stats'
+                if os.path.exists(search_stats_dir):
+                    search_info = pkl.load(open(search_stats_dir, 'rb'))
+                    for stage, stats in search_info.get('cascade', {}).items():
+                        if stage not in stage_stats:
+                            stage_stats[stage] = defaultdict(float)
+                        for key, value in stats.items():
+                            stage_stats[stage][key] += value
             else:
                 result.append(d['rank'])
     # print(len(result))
@@ -60,7 +70,8 @@ def subset_result(result_dir, f_names):
         'non_compile_r': float(num_compile_errors / num_searches),
         'f_name2gold': f_name2gold,
         'f_name2result': f_name2result,
-        '0 candidates': num_no_candidates
+        '0 candidates': num_no_candidates,
+        'stage_stats': stage_stats
     }
 
 def agg_stats(result):
@@ -82,6 +93,11 @@ def calculate_result(result_dir, opt):
     print('%d has no candidates.' % d['0 candidates'])
     print('%.3f not compilable.' % d['non_compile_r'])
     print([(key, num_rejs[key]) for key in sorted(num_rejs.keys())])
+    if len(d['stage_stats']) > 0:
+        print('rejections by stage:')
+        for stage, stats in d['stage_stats'].items():
+            print('%s: %d checked, %d rejected, %d memoized, %.1f seconds.'
+                  % (stage, stats['checked'], stats['rejected'], stats['memoized'], stats['seconds']))
 
 
 if __name__ == '__main__':
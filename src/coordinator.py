@@ -0,0 +1,163 @@
+import os
+import json
+import random
+from base64 import b64decode
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils.spoc_utils import kf_range
+from utils.work_queue import WorkQueue
+from evals.eval_store import SqliteEvalStore, eval_db_dir
+from parse.program import Program_generator
+
+# the coordinator distributes the programs of a run to search.py workers on several nodes
+# workers talk to it over HTTP with JSON bodies (see utils/coordinator_client.py), through the endpoints
+#   POST /claim {owner} -> {f_name}, f_name is None when there is nothing left
+#   POST /heartbeat {f_name, owner} -> {ok}
+#   POST /release {f_name, owner}
+#   POST /complete {f_name, owner, result, stats} -> {ok}, result and stats are base64 encoded pickles (stats may be None)
+#   POST /memo/get {pid, code} -> {status}
+#   POST /memo/put {pid, code, status, f_name}
+#   POST /stage/get {stage, pid, code} -> {status}
+#   POST /stage/put {stage, pid, code, status}
+#   POST /stats/get {pid, judge_type} -> {case_failures: testcase id -> number of failures}
+#   POST /stats/add {pid, judge_type, case_ids}
+#   GET /progress -> {state: number of programs in that state, lease_seconds}
+# the work queue, the memo and the results all live on the coordinator's disk
+
+
+class Coordinator:
+
+    def __init__(self, result_dir, f_names, memo_db_dir=eval_db_dir, lease_seconds=600):
+        self.result_dir = result_dir
+        self.queue = WorkQueue(result_dir + 'queue.db', lease_seconds=lease_seconds)
+        # the programs completed in an earlier run are done in queue.db, so they are not added again
+        # the result files are never loaded here, since their content comes from the workers
+        self.queue.add(f_names)
+        self.eval_store = SqliteEvalStore(memo_db_dir)
+
+    def claim(self, request):
+        return {'f_name': self.queue.claim(request['owner'])}
+
+    def heartbeat(self, request):
+        return {'ok': self.queue.heartbeat(request['f_name'], request['owner'])}
+
+    def release(self, request):
+        self.queue.release(request['f_name'], request['owner'])
+        return {}
+
+    # the pickles are written as they are, and never loaded here since anyone reaching the port can send them
+    # only the owner of a claimed program can complete it, which also keeps f_name to the names in the queue
+    def complete(self, request):
+        f_name, owner = request['f_name'], request['owner']
+        if not self.queue.heartbeat(f_name, owner):
+            return {'ok': False}
+        result = b64decode(request['result'])
+        stats = None if request['stats'] is None else b64decode(request['stats'])
+        with open(self.result_dir + f_name + '.pkl', 'wb') as out_file:
+            out_file.write(result)
+        if stats is not None:
+            with open(self.result_dir + f_name + '.stats', 'wb') as out_file:
+                out_file.write(stats)
+        self.queue.complete(f_name, owner)
+        return {'ok': True}
+
+    def memo_get(self, request):
+        return {'status': self.eval_store.get(request['pid'], request['code'])}
+
+    def memo_put(self, request):
+        self.eval_store.put(request['pid'], request['code'], request['status'], f_name=request.get('f_name'))
+        return {}
+
+    def stage_get(self, request):
+        return {'status': self.eval_store.get_stage(request['stage'], request['pid'], request['code'])}
+
+    def stage_put(self, request):
+        self.eval_store.put_stage(request['stage'], request['pid'], request['code'], request['status'])
+        return {}
+
+    def stats_get(self, request):
+        return {'case_failures': self.eval_store.get_case_failures(request['pid'], request['judge_type'])}
+
+    def stats_add(self, request):
+        self.eval_store.add_case_failures(request['pid'], request['judge_type'], request['case_ids'])
+        return {}
+
+    def progress(self, request=None):
+        result = self.queue.progress()
+        result['lease_seconds'] = self.queue.lease_seconds
+        return result
+
+    def handler(self):
+        coordinator = self
+        routes = {'/claim': self.claim, '/heartbeat': self.heartbeat, '/release': self.release,
+                  '/complete': self.complete, '/memo/get': self.memo_get, '/memo/put': self.memo_put,
+                  '/stage/get': self.stage_get, '/stage/put': self.stage_put,
+                  '/stats/get': self.stats_get, '/stats/add': self.stats_add, '/progress': self.progress}
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def reply(self, code, body):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path != '/progress':
+                    return self.reply(404, {'error': 'unknown path %s' % self.path})
+                self.reply(200, coordinator.progress())
+
+            def do_POST(self):
+                if self.path not in routes:
+                    return self.reply(404, {'error': 'unknown path %s' % self.path})
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    request = json.loads(self.rfile.read(length).decode())
+                    self.reply(200, routes[self.path](request))
+                except (KeyError, ValueError) as e:
+                    self.reply(400, {'error': repr(e)})
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def serve(self, host, port):
+        server = ThreadingHTTPServer((host, port), self.handler())
+        print('coordinating %s on http://%s:%d' % (self.result_dir, host, server.server_port))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument('--result_dir', type=str,
+                        help='the directory where the results of the workers are saved. '
+                             'should be the same as the result_dir printed by search.py for the same configuration.')
+    parser.add_argument('--target', type=str,
+                        help='the dataset split for evaluation, worker/problem.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='we randomly decide the order in which the programs are handed out.')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='use 0.0.0.0 to accept workers from other nodes.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--lease', type=int, default=600,
+                        help='seconds after which a program claimed by a silent worker is handed out again.')
+    parser.add_argument('--memo_db', type=str, default=eval_db_dir,
+                        help='the SQLite memo shared by all the workers.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    os.makedirs(args.result_dir, exist_ok=True)
+    file_range = kf_range(args.target)
+    if file_range is None:
+        file_range = Program_generator().f_names
+    file_range = sorted(file_range)
+    random.Random(args.seed).shuffle(file_range)
+    Coordinator(args.result_dir, file_range, memo_db_dir=args.memo_db, lease_seconds=args.lease).serve(args.host, args.port)
@@ -0,0 +1,107 @@
+import sys
+sys.path.append('./')
+
+import os
+import json
+import shutil
+import resource
+import tempfile
+from argparse import ArgumentParser
+from collections import defaultdict
+from evals import gold_judge
+from evals.gold_judge import Judge, cpu_time_limit
+from evals.testcase_registry import time_limits_name
+from parse.program import program_dir
+from utils.spoc_utils import kf_range
+
+# most gold programs finish in milliseconds, so the candidates stuck in an infinite loop
+# waste the full cpu_time_limit on every judgement
+# we run the gold programs of each problem on its testcases and set the time limit of the problem
+# to multiple * (the slowest testcase of the slowest gold program), but at least floor and at most cpu_time_limit
+# the limits are saved in the judge space, where every Judge of the problem picks them up
+default_multiple = 5
+default_floor = 0.2
+
+
+# the cpu seconds used by program_str on its slowest testcase, None if it does not pass all the testcases
+def measure_program(judge, program_str):
+    judge.exec_folder = tempfile.mkdtemp() + '/'
+    try:
+        exec_out = judge.exec_folder + 'exe.o'
+        judge.compile_program(program_str, exec_out)
+        if not os.path.exists(exec_out):
+            return None
+        max_time = 0
+        for test_input, expected_output in judge.testcases:
+            # the testcases run one at a time, so the cpu time of the waited children is the one of the testcase
+            before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            passed, _, _ = judge.run_testcase(exec_out, test_input, expected_output)
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            if not passed:
+                return None
+            max_time = max(max_time, after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime)
+        return max_time
+    finally:
+        shutil.rmtree(judge.exec_folder)
+
+
+# returns problem id -> time limit for the problems with at least one gold program passing its testcases
+def calibrate(f_names, multiple=default_multiple, floor=default_floor, programs_per_problem=3):
+    pid2f_names = defaultdict(list)
+    for f_name in sorted(f_names):
+        pid2f_names[f_name.split('-')[1]].append(f_name)
+
+    time_limits = {}
+    for pid, problem_f_names in sorted(pid2f_names.items()):
+        # measure with the default limit, not the one calibrated before
+        judge = Judge(pid, 'all', time_limit=cpu_time_limit)
+        gold_times = []
+        for f_name in problem_f_names[:programs_per_problem]:
+            with open(program_dir + f_name + '.cc', 'r') as in_file:
+                gold_time = measure_program(judge, in_file.read())
+            if gold_time is not None:
+                gold_times.append(gold_time)
+        if len(gold_times) == 0:
+            print('no gold program of %s passes, keeping the default time limit.' % pid)
+            continue
+        time_limits[pid] = round(min(cpu_time_limit, max(floor, multiple * max(gold_times))), 3)
+        print('%s: slowest gold testcase %.3fs, time limit %.3fs' % (pid, max(gold_times), time_limits[pid]))
+    return time_limits
+
+
+# merge time_limits into the ones saved in the judge space
+def save_time_limits(time_limits, judge_space_dir=None):
+    if judge_space_dir is None:
+        judge_space_dir = gold_judge.judge_space_dir
+    time_limits_path = judge_space_dir + time_limits_name
+    all_time_limits = {}
+    if os.path.exists(time_limits_path):
+        with open(time_limits_path, 'r') as in_file:
+            all_time_limits = json.load(in_file)
+    all_time_limits.update(time_limits)
+    tmp_path = '%s.tmp-%d' % (time_limits_path, os.getpid())
+    with open(tmp_path, 'w') as out_file:
+        json.dump(all_time_limits, out_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, time_limits_path)
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument('--target', type=str, default='all',
+                        help='the gold programs to measure, worker/problem/train/all.')
+    parser.add_argument('--multiple', type=float, default=default_multiple,
+                        help='the time limit is this multiple of the slowest gold testcase.')
+    parser.add_argument('--floor', type=float, default=default_floor,
+                        help='the minimum time limit in seconds.')
+    parser.add_argument('--programs_per_problem', type=int, default=3,
+                        help='number of gold programs measured for each problem.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    f_names = kf_range(args.target)
+    if f_names is None:
+        f_names = [f[:-3] for f in os.listdir(program_dir) if f[-3:] == '.cc']
+    save_time_limits(calibrate(f_names, multiple=args.multiple, floor=args.floor,
+                               programs_per_problem=args.programs_per_problem))
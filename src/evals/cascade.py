@@ -0,0 +1,90 @@
+import threading
+from timeit import default_timer as timer
+from parse.misc import braces_acceptable
+from parse.pseudo_compiler import pseudo_compile_check
+from evals.gold_judge import Judge, check_syntax
+
+# the candidates go through increasingly expensive stages, the first stage that rejects a candidate decides its status
+#   'braces': the curly braces are balanced
+#   'pseudo_compile': the program passes the semantics constraint of the structured search (parse/pseudo_compiler.py)
+#   'syntax_only': g++ -fsyntax-only, which parses and type checks without generating code
+# the candidates that pass the selected stages are judged, i.e. fully compiled ('compile') and tested ('tests')
+cascade_stages = ['braces', 'pseudo_compile', 'syntax_only']
+judge_stages = ['compile', 'tests']
+stage2status = {'braces': 'braces rejected', 'pseudo_compile': 'pseudo compile rejected',
+                'syntax_only': 'Compilation Error'}
+# the constraint checked by 'pseudo_compile'
+pseudo_compile_opt = 'semantics'
+# the stages whose results are memoized in the eval store,
+# the other ones are cheaper to recompute than to look up and 'pseudo_compile' also depends on the indentation
+memoized_stages = {'syntax_only'}
+
+
+# the rejection cascade of the candidates of one program
+# stats maps every stage to the number of candidates it checked and rejected, and the seconds it took
+# screen() can be called from several threads when the candidates are judged concurrently
+class Cascade:
+
+    def __init__(self, stages, pid, indent, eval_store=None, compile_profile='default'):
+        for stage in stages:
+            assert stage in cascade_stages, 'unknown stage %s' % stage
+        # run the stages in the order of cascade_stages, which is from the cheapest to the most expensive
+        self.stages = [stage for stage in cascade_stages if stage in stages]
+        self.pid = pid
+        self.indent = indent
+        self.eval_store = eval_store
+        self.compile_profile = compile_profile
+        if 'syntax_only' in self.stages and compile_profile == 'pch':
+            Judge.check_pch()
+        self.stats = {stage: {'checked': 0, 'rejected': 0, 'memoized': 0, 'seconds': 0.}
+                      for stage in self.stages + judge_stages}
+        self.lock = threading.Lock()
+
+    def count(self, stage, rejected, seconds, memoized=False):
+        with self.lock:
+            stats = self.stats[stage]
+            stats['checked'] += 1
+            stats['rejected'] += int(rejected)
+            stats['memoized'] += int(memoized)
+            stats['seconds'] += seconds
+
+    # returns None if code passes all the stages, otherwise a result like the one of a Judge,
+    # with the stage that rejected it as 'Stage'
+    def screen(self, code):
+        for stage in self.stages:
+            start = timer()
+            status, message = None, None
+            if stage in memoized_stages and self.eval_store is not None:
+                status = self.eval_store.get_stage(stage, self.pid, code)
+            memoized = status is not None
+            if not memoized:
+                status, message = self.check(stage, code)
+                if stage in memoized_stages and self.eval_store is not None:
+                    self.eval_store.put_stage(stage, self.pid, code, status)
+            self.count(stage, status != 'ok', timer() - start, memoized=memoized)
+            if status != 'ok':
+                result = {'Status': status, 'Stage': stage}
+                if message is not None:
+                    result['Error Message'] = message
+                return result
+        return None
+
+    # returns (status, message), status is 'ok' if code passes the stage
+    def check(self, stage, code):
+        if stage == 'braces':
+            passed, message = braces_acceptable(code), None
+        elif stage == 'pseudo_compile':
+            passed, message = pseudo_compile_check(code, self.indent, pseudo_compile_opt), None
+        else:
+            message = check_syntax(code, self.compile_profile)
+            passed = message == ''
+        return ('ok' if passed else stage2status[stage]), message
+
+    # count the result of a Judge in the 'compile' and 'tests' stages
+    def record_judgement(self, result):
+        if result['Status'] == 'Cancelled':
+            return
+        compile_error = result['Status'] == 'Compilation Error'
+        self.count('compile', compile_error, result.get('Compile Time', 0.))
+        if not compile_error:
+            self.count('tests', result['Status'] != 'Passed', result.get('Test Time', 0.))
@@ -0,0 +1,149 @@
+import os
+import shutil
+import hashlib
+import threading
+from parse.lexer import tokenize
+
+compile_cache_dir = '../spoc/compile_cache/'
+binary_suffix, error_suffix = '.bin', '.err'
+
+# separates the tokens of a line in the normalized code
+token_sep = '\x00'
+
+
+# map a line of code to its token stream,
+# so that lines that only differ in whitespace are the same
+def normalize_line(line):
+    # whitespace inside a preprocessor directive can change its meaning
+    # e.g. #define f(x) and #define f (x)
+    if line.lstrip().startswith('#'):
+        return line
+    tokens = tokenize(line, new_line=False)
+    # the lexer silently drops the characters it cannot match (and rewrites and/or)
+    # in which case we keep the raw line so that the normalization never merges different programs
+    if ''.join([t.value for t in tokens]) != line:
+        return line
+    # the lexer does not know comments and some operators (e.g. ->* and <=>),
+    # so a / /b and a //b have the same tokens, hence adjacent operators are kept together
+    pieces, prev = [], None
+    for t in tokens:
+        if t.kind != 'whitespace':
+            if prev is not None and prev.kind == 'operator' and t.kind == 'operator':
+                pieces[-1] += t.value
+            else:
+                pieces.append(t.value)
+        prev = t
+    return token_sep.join(pieces)
+
+
+def normalize_code(program_str):
+    return '\n'.join([normalize_line(line) for line in program_str.split('\n')])
+
+
+# hash of the normalized code, extra is anything else the result depends on (e.g. the compile profile)
+# the version is bumped whenever normalize_line changes, so that the entries stored with older hashes are not reused
+normalize_version = '2'
+
+
+def code_hash(program_str, extra=''):
+    return hashlib.sha1((normalize_version + '\n' + extra + '\n' + normalize_code(program_str)).encode()).hexdigest()
+
+
+# a size-bounded on-disk store of compilation results keyed by code_hash
+# either the executable or the compiler message of a failed compilation is stored
+# the modification time of an entry is its last access time, and the least recently used entries are evicted
+# several processes may share the same cache_dir
+class CompileCache:
+
+    def __init__(self, cache_dir=compile_cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.total_bytes = sum([size for _, _, size in self.list_entries()])
+
+    def entry_path(self, key, suffix):
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    def list_entries(self):
+        entries = []
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if not entry.name.endswith((binary_suffix, error_suffix)):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    # returns ('binary', path to the executable), ('error', compiler message) or None
+    def get(self, key):
+        for suffix, kind in ((binary_suffix, 'binary'), (error_suffix, 'error')):
+            path = self.entry_path(key, suffix)
+            try:
+                # mark the entry as recently used
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+            self.hits += 1
+            if kind == 'binary':
+                return kind, path
+            try:
+                with open(path, 'r') as in_file:
+                    return kind, in_file.read()
+            except FileNotFoundError:
+                # evicted by another process in between
+                break
+        self.misses += 1
+        return None
+
+    # copy a cached executable to exec_out
+    @staticmethod
+    def fetch_binary(path, exec_out):
+        try:
+            os.link(path, exec_out)
+        except OSError:
+            shutil.copy2(path, exec_out)
+
+    def put_binary(self, key, exec_out):
+        path = self.entry_path(key, binary_suffix)
+        tmp_path = '%s.tmp-%d-%d' % (path, os.getpid(), threading.get_ident())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copy2(exec_out, tmp_path)
+        self.add_entry(tmp_path, path)
+
+    def put_error(self, key, compile_msg):
+        path = self.entry_path(key, error_suffix)
+        tmp_path = '%s.tmp-%d-%d' % (path, os.getpid(), threading.get_ident())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w') as out_file:
+            out_file.write(compile_msg)
+        self.add_entry(tmp_path, path)
+
+    def add_entry(self, tmp_path, path):
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    # remove the least recently used entries until the cache is below 90% of its size bound
+    # the size is re-measured since other processes also write to the cache
+    def evict(self):
+        entries = sorted(self.list_entries())
+        self.total_bytes = sum([size for _, _, size in entries])
+        target_bytes = int(self.max_bytes * 0.9)
+        for _, path, size in entries:
+            if self.total_bytes <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
@@ -0,0 +1,161 @@
+import sys
+sys.path.append('./')
+
+import os
+import time
+import sqlite3
+import threading
+import pickle as pkl
+from argparse import ArgumentParser
+from evals.compile_cache import code_hash
+
+eval_store_dir = '../spoc/eval_store/'
+eval_db_dir = '../spoc/eval_memo.db'
+eval_memo_dir = '../spoc/eval_memo/'
+
+
+# the judge status of a program depends only on the problem (i.e. the testcases) and the code,
+# so the evaluation results can be shared by all the programs written for the same problem
+# FileEvalStore keeps one small file per (problem id, normalized code hash)
+# every entry is written to a temporary file and atomically renamed,
+# so concurrent search processes can share the same store_dir without clobbering each other
+class FileEvalStore:
+
+    def __init__(self, store_dir=eval_store_dir):
+        self.store_dir = store_dir
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    # the results of a stage of the rejection cascade (see evals/cascade.py) are kept in a separate folder
+    def entry_path(self, pid, code, stage=None):
+        if stage is not None:
+            return os.path.join(self.store_dir, 'stage-' + stage, pid, code_hash(code))
+        return os.path.join(self.store_dir, pid, code_hash(code))
+
+    def get(self, pid, code, stage=None):
+        try:
+            with open(self.entry_path(pid, code, stage), 'r') as in_file:
+                return in_file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, pid, code, status, f_name=None, stage=None):
+        path = self.entry_path(pid, code, stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.tmp-%d-%d' % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as out_file:
+            out_file.write(status)
+        os.replace(tmp_path, path)
+
+    def get_stage(self, stage, pid, code):
+        return self.get(pid, code, stage=stage)
+
+    def put_stage(self, stage, pid, code, status):
+        self.put(pid, code, status, stage=stage)
+
+    # testcase failure statistics are only kept by SqliteEvalStore
+    def get_case_failures(self, pid, judge_type):
+        return {}
+
+    def add_case_failures(self, pid, judge_type, case_ids):
+        pass
+
+
+# SqliteEvalStore keeps the evaluation results in an SQLite database in WAL mode
+# every judgement is upserted in its own transaction as soon as it completes,
+# so a crash loses nothing and concurrent search processes do not overwrite each other
+# it also counts, for each testcase, how many candidates failed on it (see order_testcases in evals/gold_judge.py)
+# and keeps the results of the stages of the rejection cascade (see evals/cascade.py) apart from the judgements
+class SqliteEvalStore:
+
+    def __init__(self, db_dir=eval_db_dir, timeout=60):
+        self.db_dir = db_dir
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_dir, timeout=timeout, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS judgements ('
+                              'pid TEXT NOT NULL, code_hash TEXT NOT NULL, status TEXT NOT NULL, '
+                              'f_name TEXT, updated REAL, PRIMARY KEY (pid, code_hash))')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS judgements_code_hash ON judgements (code_hash)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS testcase_failures ('
+                              'pid TEXT NOT NULL, judge_type TEXT NOT NULL, case_id INTEGER NOT NULL, '
+                              'failures INTEGER NOT NULL, PRIMARY KEY (pid, judge_type, case_id))')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS stage_results ('
+                              'stage TEXT NOT NULL, pid TEXT NOT NULL, code_hash TEXT NOT NULL, status TEXT NOT NULL, '
+                              'updated REAL, PRIMARY KEY (stage, pid, code_hash))')
+
+    def get(self, pid, code):
+        with self.lock:
+            row = self.conn.execute('SELECT status FROM judgements WHERE pid = ? AND code_hash = ?',
+                                    (pid, code_hash(code))).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, pid, code, status, f_name=None):
+        self.put_many([(pid, code, status, f_name)])
+
+    # entries is a list of (pid, code, status, f_name), upserted in one transaction
+    def put_many(self, entries):
+        now = time.time()
+        rows = [(pid, code_hash(code), status, f_name, now) for pid, code, status, f_name in entries]
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT INTO judgements (pid, code_hash, status, f_name, updated) '
+                                  'VALUES (?, ?, ?, ?, ?) '
+                                  'ON CONFLICT (pid, code_hash) DO UPDATE SET '
+                                  'status = excluded.status, f_name = excluded.f_name, updated = excluded.updated',
+                                  rows)
+
+    def get_stage(self, stage, pid, code):
+        with self.lock:
+            row = self.conn.execute('SELECT status FROM stage_results WHERE stage = ? AND pid = ? AND code_hash = ?',
+                                    (stage, pid, code_hash(code))).fetchone()
+        return None if row is None else row[0]
+
+    def put_stage(self, stage, pid, code, status):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT INTO stage_results (stage, pid, code_hash, status, updated) VALUES (?, ?, ?, ?, ?) '
+                              'ON CONFLICT (stage, pid, code_hash) DO UPDATE SET '
+                              'status = excluded.status, updated = excluded.updated',
+                              (stage, pid, code_hash(code), status, time.time()))
+
+    # testcase id -> number of candidates that failed on it
+    def get_case_failures(self, pid, judge_type):
+        with self.lock:
+            rows = self.conn.execute('SELECT case_id, failures FROM testcase_failures WHERE pid = ? AND judge_type = ?',
+                                     (pid, judge_type)).fetchall()
+        return dict(rows)
+
+    def add_case_failures(self, pid, judge_type, case_ids):
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT INTO testcase_failures (pid, judge_type, case_id, failures) '
+                                  'VALUES (?, ?, ?, 1) '
+                                  'ON CONFLICT (pid, judge_type, case_id) DO UPDATE SET failures = failures + 1',
+                                  [(pid, judge_type, case_id) for case_id in case_ids])
+
+    def close(self):
+        self.conn.close()
+
+
+# copy the per-program pickle memos in memo_dir into a store
+# the problem id of a memo file [subid]-[probid]-[workerid] is its probid
+def migrate_pickle_memo(store, memo_dir=eval_memo_dir):
+    num_entries = 0
+    for f_name in sorted(os.listdir(memo_dir)):
+        if len(f_name.split('-')) != 3:
+            continue
+        pid = f_name.split('-')[1]
+        with open(os.path.join(memo_dir, f_name), 'rb') as in_file:
+            memo = pkl.load(in_file)
+        store.put_many([(pid, code, status, f_name) for code, status in memo.items()])
+        num_entries += len(memo)
+    return num_entries
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='migrate the pickle memos in ../spoc/eval_memo/ into the SQLite memo.')
+    parser.add_argument('--memo_dir', type=str, default=eval_memo_dir)
+    parser.add_argument('--db_dir', type=str, default=eval_db_dir)
+    args = parser.parse_args()
+    store = SqliteEvalStore(args.db_dir)
+    print('migrated %d entries.' % migrate_pickle_memo(store, args.memo_dir))
+    store.close()
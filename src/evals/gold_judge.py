@@ -1,9 +1,20 @@
+import sys
+sys.path.append('./')
+
 import os
 import shutil
 import time
 import subprocess
 from timeit import default_timer as timer
-import filecmp
+import selectors
+import re
+import math
+import signal
+from evals.compile_cache import code_hash
+from evals.testcase_registry import registry as testcase_registry
+from evals.testcase_archive import build_testcase_archive, archive_name
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 testcase_dir = '../spoc/testcases/'
 judge_space_dir = '../judge_space/'
@@ -12,7 +23,148 @@ test_output_symbol = '###ENDOUTPUT###\n'
 
 source_header = '#include <bits/stdc++.h>\n\nusing namespace std;\n\n'
 
-def prepare_judge_folder():
+# 'default' compiles every candidate with plain g++
+# 'pch' reuses a precompiled source_header built once per judge space, compiling with pch_flags
+compile_profiles = {'default', 'pch'}
+pch_header_name = 'judge_pch.h'
+pch_flags = ['-O0', '-pipe']
+# the header is replaced by a single include padded with empty lines
+# so that line numbers in the compiler messages stay the same as with source_header
+pch_source_header = '#include "%s"\n' % pch_header_name + '\n' * (source_header.count('\n') - 1)
+
+# g++ reports errors as <file>:<line>:<column>: error: <message>, the file is <stdin> for check_syntax
+compile_error_pattern = re.compile(r'^.*?(?:source\.cc|<stdin>):(\d+):(?:(\d+):)? (?:fatal )?error: (.*)$', re.M)
+
+
+# the index of the program line that a compilation error can be blamed on, None if we are not sure
+# we only blame syntax errors (expected ... / stray ...) that all occur on the same line,
+# errors such as undeclared variables or type mismatches might be caused by other lines,
+# and errors about braces or the end of input concern the whole program
+def blame_compile_error(compile_msg, program_by_line):
+    errors = compile_error_pattern.findall(compile_msg)
+    if len(errors) == 0:
+        return None
+    error_lines = set()
+    for line_num, column, message in errors:
+        if not (message.startswith('expected') or message.startswith('stray')):
+            return None
+        if '{' in message or '}' in message or 'end of input' in message:
+            return None
+        # the lines of source_header come before the program
+        line_idx = int(line_num) - source_header.count('\n') - 1
+        if not 0 <= line_idx < len(program_by_line):
+            return None
+        # g++ reports a missing token (e.g. int a = 5 without ;) as expected ... before the next token,
+        # which is the first token of a later line if the missing token was at the end of a line,
+        # so the error does not tell which of the lines before is wrong
+        if ' before ' in message and (column == '' or int(column) <= first_token_column(program_by_line[line_idx])):
+            return None
+        error_lines.add(line_idx)
+    if len(error_lines) != 1:
+        return None
+    return error_lines.pop()
+
+
+# the index of the program line that the compilation error of a judge or cascade result can be blamed on
+# a result without the compiler message (a syntax error memoized by the cascade) is not blamed
+def blame_result(result, program_by_line):
+    if result['Status'] != 'Compilation Error' or 'Error Message' not in result:
+        return None
+    return blame_compile_error(result['Error Message'], program_by_line)
+
+
+# the column (starting from 1) of the first token of a line as g++ reports it
+# g++ counts a tab up to the next multiple of 8 columns, we take the larger count so that we never blame the first token
+def first_token_column(line):
+    indent = line[:len(line) - len(line.lstrip())]
+    display_column = 0
+    for c in indent:
+        display_column = display_column + 8 - display_column % 8 if c == '\t' else display_column + 1
+    return display_column + 1
+
+
+def get_pch_dir():
+    return judge_space_dir + 'pch/'
+
+
+# the precompiled header is only valid for the same header, compiler and flags
+def get_pch_stamp():
+    compiler_version = subprocess.check_output(['g++', '--version']).decode()
+    return '\n'.join([source_header, ' '.join(pch_flags), compiler_version])
+
+
+# build the precompiled header for source_header if it is missing or stale
+# returns whether a usable precompiled header exists
+def prepare_pch():
+    pch_dir = get_pch_dir()
+    header_file = pch_dir + pch_header_name
+    gch_file = header_file + '.gch'
+    stamp_file = pch_dir + 'stamp.txt'
+    try:
+        stamp = get_pch_stamp()
+    except (OSError, subprocess.CalledProcessError):
+        return False
+
+    if os.path.exists(gch_file) and os.path.exists(stamp_file):
+        with open(stamp_file, 'r') as in_file:
+            if in_file.read() == stamp:
+                return True
+
+    os.makedirs(pch_dir, exist_ok=True)
+    # several processes may build at the same time,
+    # so build into temporary files and atomically move them into place
+    tmp_suffix = '.tmp-%d' % os.getpid()
+    with open(header_file + tmp_suffix, 'w') as out_file:
+        out_file.write(source_header)
+    os.replace(header_file + tmp_suffix, header_file)
+    return_code = subprocess.call(['g++'] + pch_flags + ['-x', 'c++-header', header_file, '-o', gch_file + tmp_suffix],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120)
+    if return_code != 0 or not os.path.exists(gch_file + tmp_suffix):
+        return False
+    os.replace(gch_file + tmp_suffix, gch_file)
+    with open(stamp_file + tmp_suffix, 'w') as out_file:
+        out_file.write(stamp)
+    os.replace(stamp_file + tmp_suffix, stamp_file)
+    return True
+
+
+# returns the header to prepend to the source and the compile command
+def get_compile_command(source_file, exec_out, compile_profile='default'):
+    if compile_profile == 'pch':
+        pch_dir = get_pch_dir()
+        # fall back to the default command if the precompiled header is gone
+        if os.path.exists(pch_dir + pch_header_name + '.gch'):
+            return pch_source_header, ['g++'] + pch_flags + ['-Winvalid-pch', '-I', pch_dir, source_file, '-o', exec_out]
+    return source_header, ['g++', source_file, '-o', exec_out]
+
+
+# parse and type check program_str without generating code (g++ -fsyntax-only), reading the source from stdin
+# returns the compiler message, which is empty if the program passes
+def check_syntax(program_str, compile_profile='default'):
+    header, compile_command = get_compile_command('-', None, compile_profile)
+    # drop the output file and read a c++ source from stdin
+    compile_command = compile_command[:-3] + ['-fsyntax-only', '-x', 'c++', '-']
+    try:
+        proc = subprocess.run(compile_command, input=(header + program_str).encode(),
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+    except subprocess.TimeoutExpired:
+        return 'syntax check timed out.'
+    if proc.returncode == 0:
+        return ''
+    # g++ prints nothing when killed, the message must not be empty to report the failure
+    return proc.stdout.decode(errors='replace') or 'g++ exited with %d.' % proc.returncode
+
+# packed: write all the testcases into one archive in the judge space (see evals/testcase_archive.py),
+# only splitting the testcase files that changed since the last setup
+# otherwise: rebuild the judge space with one input and one output file per testcase
+def prepare_judge_folder(packed=True):
+    if packed:
+        os.makedirs(judge_space_dir, exist_ok=True)
+        num_reused, num_split = build_testcase_archive(testcase_dir, judge_space_dir + archive_name,
+                                                       test_input_symbol, test_output_symbol)
+        print('%d testcase files unchanged, %d testcase files packed.' % (num_reused, num_split))
+        return
+
     try:
         shutil.rmtree(judge_space_dir)
     except FileNotFoundError:
@@ -69,16 +221,185 @@ def prepare_judge_folder():
                     
 # prepare_judge_folder()
 
+# maximum number of bytes of stderr kept as the error message of a testcase
+max_err_bytes = 64 * 1024
+
+# a testcase is limited by the cpu time it uses rather than by the wall clock,
+# so that a machine loaded with many search processes does not turn correct programs into TLE
+# this is the limit of the problems without a calibrated time limit (see evals/calibrate_time_limits.py)
+cpu_time_limit = 2
+# RLIMIT_CPU has a granularity of one second, so finer limits are enforced by polling the cpu time of the testcase
+cpu_poll_interval = 0.02
+clock_ticks = os.sysconf('SC_CLK_TCK')
+# bytes of address space of a testcase
+memory_limit = 512 * 1024 ** 2
+# generous wall clock backstop, for programs that block (e.g. on reading more input) without using cpu time
+wall_time_limit = 10
+
+
+# parse a core list such as '0-3,8' into a sorted list of core ids
+def parse_cores(cores_str):
+    cores = set()
+    for part in cores_str.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cores.update(range(int(first), int(last) + 1))
+        elif part != '':
+            cores.add(int(part))
+    return sorted(cores)
+
+
+# the command prefix that applies the limits to the executable and pins it to cores (None to not pin)
+# prlimit and taskset (util-linux) set them and exec the executable in the same process,
+# a preexec_fn would run python code in the forked child, which is unsafe since the judge forks from several threads,
+# and keeps subprocess from using vfork, so every testcase would copy the page tables of the whole search process
+def get_limit_command(cores=None, time_limit=cpu_time_limit):
+    rlimit_cpu = math.ceil(time_limit)
+    # the soft limit sends SIGXCPU, the hard limit SIGKILL in case the program handles SIGXCPU
+    command = ['prlimit', '--cpu=%d:%d' % (rlimit_cpu, rlimit_cpu + 1), '--as=%d:%d' % (memory_limit, memory_limit)]
+    if cores is not None:
+        command += ['taskset', '--cpu-list', ','.join([str(core) for core in cores])]
+    return command
+
+
+# seconds of cpu time used by a process, 0 if it is gone
+def get_cpu_time(pid):
+    try:
+        with open('/proc/%d/stat' % pid, 'rb') as in_file:
+            # the fields after the (command name) start with the state, utime and stime are the 12th and 13th
+            fields = in_file.read().rsplit(b')', 1)[1].split()
+    except OSError:
+        return 0
+    return (int(fields[11]) + int(fields[12])) / clock_ticks
+
+
+# feed test_input to a running testcase through its stdin,
+# read its stdout and compare it with expected_output incrementally
+# the process is killed as soon as the output differs or is longer than expected,
+# or when it does not finish within time_limit seconds (wall clock)
+# a process killed for exceeding its cpu time limit is reported as TLE
+# with cpu_limit, the process is also killed once it used more than cpu_limit seconds of cpu time
+# returns (whether passed, status, error message)
+def run_and_compare(proc, test_input, expected_output, time_limit, cpu_limit=None):
+    start = time.monotonic()
+    deadline = start + time_limit
+    selector = selectors.DefaultSelector()
+    selector.register(proc.stdout, selectors.EVENT_READ, 'stdout')
+    selector.register(proc.stderr, selectors.EVENT_READ, 'stderr')
+    num_matched, diverged, err_chunks, err_bytes = 0, False, [], 0
+    num_written = 0
+    if len(test_input) > 0:
+        os.set_blocking(proc.stdin.fileno(), False)
+        selector.register(proc.stdin, selectors.EVENT_WRITE, 'stdin')
+    else:
+        proc.stdin.close()
+    try:
+        while len(selector.get_map()) > 0 and not diverged:
+            now = time.monotonic()
+            remaining = deadline - now
+            if remaining <= 0:
+                proc.kill()
+                proc.wait()
+                return False, 'TLE', 'Time Limit Exceeds.'
+            # a single threaded process cannot use more cpu time than wall clock time,
+            # so the cpu time only needs to be checked after cpu_limit seconds
+            if cpu_limit is not None and now - start >= cpu_limit:
+                if get_cpu_time(proc.pid) > cpu_limit:
+                    proc.kill()
+                    proc.wait()
+                    return False, 'TLE', 'Time Limit Exceeds.'
+                remaining = min(remaining, cpu_poll_interval)
+            elif cpu_limit is not None:
+                remaining = min(remaining, start + cpu_limit - now)
+            for key, _ in selector.select(remaining):
+                if key.data == 'stdin':
+                    try:
+                        num_written += os.write(key.fileobj.fileno(), test_input[num_written:num_written + 65536])
+                    except BrokenPipeError:
+                        # the program exited without reading all the input
+                        num_written = len(test_input)
+                    if num_written == len(test_input):
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                    continue
+                data = os.read(key.fileobj.fileno(), 65536)
+                if len(data) == 0:
+                    selector.unregister(key.fileobj)
+                elif key.data == 'stdout':
+                    if expected_output[num_matched:num_matched + len(data)] != data:
+                        diverged = True
+                        break
+                    num_matched += len(data)
+                elif err_bytes < max_err_bytes:
+                    err_chunks.append(data)
+                    err_bytes += len(data)
+        if diverged:
+            proc.kill()
+            proc.wait()
+        else:
+            # the process closed its output, it exits soon unless it keeps running (e.g. sleeps or loops)
+            while True:
+                wait_time = max(deadline - time.monotonic(), 0)
+                if cpu_limit is not None:
+                    wait_time = min(wait_time, cpu_poll_interval)
+                try:
+                    proc.wait(timeout=wait_time)
+                    break
+                except subprocess.TimeoutExpired:
+                    if time.monotonic() >= deadline or (cpu_limit is not None and get_cpu_time(proc.pid) > cpu_limit):
+                        proc.kill()
+                        proc.wait()
+                        return False, 'TLE', 'Time Limit Exceeds.'
+            if proc.returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+                return False, 'TLE', 'Time Limit Exceeds.'
+    finally:
+        selector.close()
+        for pipe in (proc.stdin, proc.stdout, proc.stderr):
+            pipe.close()
+
+    # whether it is the same as ground truth
+    if not diverged and num_matched == len(expected_output):
+        return True, 'Passed', ''
+    return False, 'Execution Error', b''.join(err_chunks).decode(errors='replace')
+
+
+# the order in which to run the testcases of a problem, given case_failures (testcase id -> number of past failures)
+# the testcases that rejected the most candidates come first, so that an eager judge rejects most wrong candidates
+# after one or two testcases; ties (e.g. testcases that never failed) keep their original order
+def order_testcases(case_failures, num_cases):
+    if not case_failures:
+        return list(range(num_cases))
+    return sorted(range(num_cases), key=lambda case_id: -case_failures.get(case_id, 0))
+
+
+# the ids of the testcases a judge result failed on
+def get_failed_cases(result):
+    if 'Failed Case' in result:
+        return [result['Failed Case']]
+    return [case_id for case_id, (passed, _) in enumerate(result.get('Case Status', [])) if not passed]
+
+
 class Judge:
     
     judge_id = 0
+    pch_checked = False
     # initialize a judge by locating the folder for problem id and judge type ('hidden', 'public', '')
-    def __init__(self, problem_id, judge_type, eager=False, judge_id=None, compile_only=False):
+    # num_workers > 1 runs the testcases of a compiled program concurrently
+    # compile_profile is one of compile_profiles
+    # compile_cache is a CompileCache shared by the judges, None to always compile
+    # sandbox_pool is a SandboxPool to execute in, None to create an execution folder in the judge space
+    # cores is a list of core ids the testcases are pinned to, None to run them on any core
+    # time_limit is the cpu time limit of a testcase in seconds,
+    # None to use the calibrated limit of the problem (or cpu_time_limit if it has not been calibrated)
+    # case_failures maps a testcase id to the number of past failures on it, the testcases failing the most are run first
+    # an eager judge reports the id of the testcase it failed on as 'Failed Case'
+    def __init__(self, problem_id, judge_type, eager=False, judge_id=None, compile_only=False, num_workers=1,
+                 compile_profile='default', compile_cache=None, sandbox_pool=None, cores=None, time_limit=None,
+                 case_failures=None):
         self.problem_id = problem_id
-        test_cases_dir = '%s/%s/%s/' % (judge_space_dir, problem_id, judge_type)
-        num_test_cases = len(os.listdir(test_cases_dir)) // 2
-        self.intput_output_f_dir_name = [['%s%d.%s' % (test_cases_dir, test_case_id, suffix) for suffix in ['in', 'out']]
-                                         for test_case_id in range(num_test_cases)]
+        # list of (input, expected output), loaded once per process by the testcase registry
+        self.testcases = testcase_registry.get(judge_space_dir, problem_id, judge_type)
+        self.case_order = order_testcases(case_failures, len(self.testcases))
         if judge_id is None:
             self.id = Judge.judge_id
         else:
@@ -86,10 +407,40 @@ class Judge:
         self.eager = eager
         Judge.judge_id += 1
         self.compile_only = compile_only
+        self.num_workers = num_workers
+        self.compile_profile = compile_profile
+        self.compile_cache = compile_cache
+        self.sandbox_pool = sandbox_pool
+        if time_limit is None:
+            time_limit = testcase_registry.get_time_limit(judge_space_dir, problem_id, default=cpu_time_limit)
+        self.time_limit = time_limit
+        self.limit_command = get_limit_command(cores, time_limit)
+        if compile_profile == 'pch':
+            Judge.check_pch()
+        # processes currently running a testcase, killed when an eager judge cancels the rest
+        self.running, self.running_lock = set(), threading.Lock()
+        self.cancelled = threading.Event()
+
+    # check (and build if necessary) the precompiled header once per process
+    @staticmethod
+    def check_pch():
+        if not Judge.pch_checked:
+            if not prepare_pch():
+                print('precompiled header not available, using the default compile command.')
+            Judge.pch_checked = True
 
     def judge_program_str(self, program_str, program_suffix=''):
-        result = self.judge_program_str_(program_str, program_suffix)
-        shutil.rmtree(self.exec_folder)
+        if self.sandbox_pool is not None:
+            # execute in a slot of the sandbox pool, which is cleaned when released
+            self.exec_folder = self.sandbox_pool.acquire()
+            try:
+                result = self.judge_in_exec_folder(program_str)
+            finally:
+                self.sandbox_pool.release(self.exec_folder)
+        else:
+            result = self.judge_program_str_(program_str, program_suffix)
+            shutil.rmtree(self.exec_folder)
+        self.cancelled.clear()
         return result
     
     def judge_program_str_(self, program_str, program_suffix=''):
@@ -99,7 +450,9 @@ class Judge:
          
         # put all the source & executable in this directory
         self.exec_folder = '%s%s/%s-exec/' % (judge_space_dir, self.problem_id, program_suffix)
-        
+        # with a packed judge space the problem folder only holds the executions
+        os.makedirs('%s%s/' % (judge_space_dir, self.problem_id), exist_ok=True)
+
         try:
             os.mkdir(self.exec_folder)
         except:
@@ -107,66 +460,144 @@ class Judge:
             # put all the source & executable in this directory
             self.exec_folder = '%s%s/%s-exec/' % (judge_space_dir, self.problem_id, program_suffix)
             os.mkdir(self.exec_folder)
+        return self.judge_in_exec_folder(program_str)
 
-        # write the source file
-        source_file = self.exec_folder + 'source.cc'
-        with open(source_file, 'w') as out_file:
-            out_file.write(source_header)
-            out_file.write(program_str)
+    # compile and run program_str in self.exec_folder
+    # the result also holds the seconds spent compiling and testing as 'Compile Time' and 'Test Time'
+    def judge_in_exec_folder(self, program_str):
         exec_out = self.exec_folder + 'exe.o'
-        compiler_message_file = self.exec_folder + 'compiler-message.txt'
-        
-        # try compilation
-        subprocess.call('g++ %s -o %s > %s 2>&1' % (source_file, exec_out, compiler_message_file), shell=True, timeout=60)
-
-        with open(compiler_message_file, 'r') as in_file:
-            compile_msg = in_file.read()
+        start = timer()
+        compile_msg = self.compile_program(program_str, exec_out)
+        compile_time = timer() - start
 
         # if executable still does not exist, compilation fails
         if not os.path.exists(exec_out):
             return {
                 'Status': 'Compilation Error',
-                'Error Message': compile_msg
+                'Error Message': compile_msg,
+                'Compile Time': compile_time
             }
+        start = timer()
+        result = self.run_testcases(exec_out)
+        result['Compile Time'], result['Test Time'] = compile_time, timer() - start
+        return result
 
+    # run the testcases on the compiled exec_out
+    def run_testcases(self, exec_out):
         if self.compile_only:
             return {'Status': 'Compile Successful'}
 
-        pass_status = []
+        # cancel_running() was called while compiling
+        if self.cancelled.is_set():
+            return {'Status': 'Cancelled'}
+
+        if self.num_workers > 1:
+            return self.run_testcases_parallel(exec_out)
+
+        pass_status = [None] * len(self.testcases)
         # test on each cases
-        for testcase_id, (input_file, output_file) in enumerate(self.intput_output_f_dir_name):
-            pred_out = '%s%dpred.txt' % (self.exec_folder, testcase_id)
-            err_out = '%s%derr.txt' % (self.exec_folder, testcase_id)
-            
-            # execute and obtain the results
-            fkwargs = {
-                'stdin': open(input_file, 'r'),
-                'stdout': open(pred_out, 'w'),
-                'stderr': open(err_out, 'w')
-            }
-            try:
-                result = subprocess.call(exec_out, **fkwargs, timeout=2)
-            except subprocess.TimeoutExpired:
-                pass_status.append((False, 'Time Limit Exceeds.'))
-                if self.eager:
-                    return {"Status": "TLE"}
-                continue
-            [fkwargs[key].close() for key in fkwargs]
-
-            f_equal = filecmp.cmp(pred_out, output_file)
-
-            # whether it is the same as ground truth
-            if f_equal:
-                pass_status.append((True, ''))
+        for case_id in self.case_order:
+            test_input, expected_output = self.testcases[case_id]
+            passed, status, err_msg = self.run_testcase(exec_out, test_input, expected_output)
+            pass_status[case_id] = (passed, err_msg)
+            if not passed and self.eager:
+                return {"Status": status, 'Failed Case': case_id}
+            if self.cancelled.is_set():
+                return {'Status': 'Cancelled'}
+        return self.summarize(pass_status)
+
+    # compile program_str into exec_out and return the compiler message
+    # the compile cache (if any) is consulted first
+    def compile_program(self, program_str, exec_out):
+        cache_key = None
+        if self.compile_cache is not None:
+            cache_key = code_hash(program_str, extra=self.compile_profile)
+            cached = self.compile_cache.get(cache_key)
+            if cached is not None:
+                kind, value = cached
+                if kind == 'error':
+                    return value
+                try:
+                    self.compile_cache.fetch_binary(value, exec_out)
+                    return ''
+                except FileNotFoundError:
+                    # evicted in between, compile it again
+                    pass
+
+        # write the source file
+        source_file = self.exec_folder + 'source.cc'
+        compiler_message_file = self.exec_folder + 'compiler-message.txt'
+        header, compile_command = get_compile_command(source_file, exec_out, self.compile_profile)
+        with open(source_file, 'w') as out_file:
+            out_file.write(header)
+            out_file.write(program_str)
+
+        # try compilation
+        with open(compiler_message_file, 'w') as out_file:
+            subprocess.call(compile_command, stdout=out_file, stderr=subprocess.STDOUT, timeout=60)
+
+        with open(compiler_message_file, 'r') as in_file:
+            compile_msg = in_file.read()
+
+        if cache_key is not None:
+            if os.path.exists(exec_out):
+                self.compile_cache.put_binary(cache_key, exec_out)
             else:
-                with open(err_out, 'r') as in_file:
-                    err_msg = in_file.read()
-                pass_status.append((False, err_msg))
-                if self.eager:
-                    return {"Status": "Execution Error"}
-        
+                self.compile_cache.put_error(cache_key, compile_msg)
+        return compile_msg
+
+    # run the executable on a single testcase
+    # returns (whether passed, status, error message)
+    def run_testcase(self, exec_out, test_input, expected_output):
+        # execute and compare the output with the ground truth while it is being printed
+        proc = subprocess.Popen(self.limit_command + [exec_out],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with self.running_lock:
+            self.running.add(proc)
+            if self.cancelled.is_set():
+                proc.kill()
+        try:
+            passed, status, err_msg = run_and_compare(proc, test_input, expected_output, time_limit=wall_time_limit,
+                                                      cpu_limit=self.time_limit)
+        finally:
+            with self.running_lock:
+                self.running.discard(proc)
+
+        # killed by cancel_running(), the output says nothing about the program
+        if self.cancelled.is_set():
+            return False, 'Cancelled', ''
+        return passed, status, err_msg
+
+    # run all the testcases through a pool of num_workers threads
+    # if eager, the first failure cancels all the other testcases
+    def run_testcases_parallel(self, exec_out):
+        pass_status = [None] * len(self.testcases)
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            # the pool starts the testcases in the order they are submitted
+            future2id = {pool.submit(self.run_testcase, exec_out, *self.testcases[testcase_id]): testcase_id
+                         for testcase_id in self.case_order}
+            for future in as_completed(future2id):
+                passed, status, err_msg = future.result()
+                pass_status[future2id[future]] = (passed, err_msg)
+                if not passed and self.eager:
+                    self.cancel_running(future2id)
+                    return {"Status": status, 'Failed Case': future2id[future]}
+        if self.cancelled.is_set():
+            return {'Status': 'Cancelled'}
+        return self.summarize(pass_status)
+
+    # kill the running testcases and skip the remaining ones, the judge then reports 'Cancelled'
+    def cancel_running(self, futures=()):
+        for future in futures:
+            future.cancel()
+        with self.running_lock:
+            self.cancelled.set()
+            for proc in self.running:
+                proc.kill()
+
+    @staticmethod
+    def summarize(pass_status):
         # all execution information has been collected
-        
         all_passed = True
         for s, _ in pass_status:
             if not s:
@@ -179,7 +610,7 @@ class Judge:
                 'Status': 'Execution Error',
                 'Case Status': pass_status
             }
-    
+
 def debug_judge():
     j = Judge('86A', 'all')
     with open('evals/86A.sol', 'r') as in_file:
@@ -0,0 +1,56 @@
+import os
+import queue
+import shutil
+import atexit
+
+default_sandbox_dir = '/dev/shm/spoc_judge/'
+
+
+# a fixed pool of execution folders (slots) for the judges of a process, created once on a RAM-backed directory
+# a judge acquires a slot, writes its source/executable/compiler message there and releases it,
+# which only removes the files in it, instead of creating and removing a folder on the persistent disk per candidate
+class SandboxPool:
+
+    def __init__(self, sandbox_dir=default_sandbox_dir, num_slots=8):
+        os.makedirs(sandbox_dir, exist_ok=True)
+        self.remove_stale(sandbox_dir)
+        self.root = os.path.join(sandbox_dir, 'pid-%d' % os.getpid())
+        self.free_slots = queue.Queue()
+        for slot_id in range(num_slots):
+            slot = os.path.join(self.root, 'slot-%d' % slot_id) + '/'
+            os.makedirs(slot, exist_ok=True)
+            self.clean(slot)
+            self.free_slots.put(slot)
+        atexit.register(self.close)
+
+    # remove the slots of the processes that no longer exist
+    @staticmethod
+    def remove_stale(sandbox_dir):
+        for name in os.listdir(sandbox_dir):
+            if not name.startswith('pid-'):
+                continue
+            try:
+                os.kill(int(name[len('pid-'):]), 0)
+            except ProcessLookupError:
+                shutil.rmtree(os.path.join(sandbox_dir, name), ignore_errors=True)
+            except (ValueError, PermissionError):
+                continue
+
+    @staticmethod
+    def clean(slot):
+        for entry in os.scandir(slot):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+
+    # blocks until a slot is free
+    def acquire(self):
+        return self.free_slots.get()
+
+    def release(self, slot):
+        self.clean(slot)
+        self.free_slots.put(slot)
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
@@ -0,0 +1,119 @@
+import os
+import json
+import mmap
+import struct
+
+# a single file holding the testcases of every problem, so that setup does not create one file per testcase
+# and the whole judge space can be copied to another node as one file
+# layout: archive_magic, the testcase bytes, the index as json, then a footer (index offset, index length, index_magic)
+# the index maps problem id -> judge type -> {'source': testcase file name, 'size', 'mtime_ns',
+#                                             'cases': [[input offset, input length, output offset, output length], ...]}
+archive_name = 'testcases.pack'
+archive_magic = b'SPOCTC1\n'
+index_magic = b'SPOCIDX1'
+footer_format = '<QQ8s'
+
+
+# read-only view of an archive through mmap
+class TestcaseArchive:
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        with open(archive_path, 'rb') as in_file:
+            self.mtime_ns = os.fstat(in_file.fileno()).st_mtime_ns
+            self.data = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_size = struct.calcsize(footer_format)
+        if self.data[:len(archive_magic)] != archive_magic or len(self.data) < len(archive_magic) + footer_size:
+            raise ValueError('%s is not a testcase archive' % archive_path)
+        index_offset, index_length, magic = struct.unpack(footer_format, self.data[-footer_size:])
+        if magic != index_magic:
+            raise ValueError('%s is not a testcase archive' % archive_path)
+        self.index = json.loads(self.data[index_offset:index_offset + index_length].decode())
+
+    def has(self, problem_id, judge_type):
+        return judge_type in self.index.get(problem_id, {})
+
+    # list of (input bytes, expected output bytes)
+    def get(self, problem_id, judge_type):
+        return [(self.data[in_offset:in_offset + in_length], self.data[out_offset:out_offset + out_length])
+                for in_offset, in_length, out_offset, out_length in self.index[problem_id][judge_type]['cases']]
+
+    def close(self):
+        self.data.close()
+
+
+def open_archive(archive_path):
+    try:
+        return TestcaseArchive(archive_path)
+    except (OSError, ValueError):
+        return None
+
+
+# build the archive from the testcase files in testcase_dir (see prepare_judge_folder)
+# the testcases of a source file that did not change since the previous archive are copied over,
+# only the changed ones are split again
+# returns (number of testcase files reused, number of testcase files split)
+def build_testcase_archive(testcase_dir, archive_path, test_input_symbol, test_output_symbol):
+    old_archive = open_archive(archive_path)
+    sources = []
+    for problem_id in sorted(os.listdir(testcase_dir)):
+        read_problem_folder = os.path.join(testcase_dir, problem_id)
+        if not os.path.isdir(read_problem_folder):
+            continue
+        for test_file_name in sorted(os.listdir(read_problem_folder)):
+            if test_file_name[-4:] != '.txt':
+                continue
+            f_info = test_file_name[:-4].split('_')
+            if len(f_info) == 2:
+                f_info.append('all')
+            assert f_info[0] == problem_id
+            stat = os.stat(os.path.join(read_problem_folder, test_file_name))
+            sources.append((problem_id, f_info[-1], test_file_name, stat.st_size, stat.st_mtime_ns))
+
+    def unchanged(problem_id, judge_type, test_file_name, size, mtime_ns):
+        if old_archive is None or not old_archive.has(problem_id, judge_type):
+            return False
+        entry = old_archive.index[problem_id][judge_type]
+        return (entry['source'], entry['size'], entry['mtime_ns']) == (test_file_name, size, mtime_ns)
+
+    num_reused = len([source for source in sources if unchanged(*source)])
+    if old_archive is not None and num_reused == len(sources) \
+            and len(sources) == sum([len(entries) for entries in old_archive.index.values()]):
+        old_archive.close()
+        return num_reused, 0
+
+    index = {}
+    tmp_path = '%s.tmp-%d' % (archive_path, os.getpid())
+    with open(tmp_path, 'wb') as out_file:
+        out_file.write(archive_magic)
+        for problem_id, judge_type, test_file_name, size, mtime_ns in sources:
+            if unchanged(problem_id, judge_type, test_file_name, size, mtime_ns):
+                testcases = old_archive.get(problem_id, judge_type)
+            else:
+                # read the test cases contained in a single file and split them by the end symbol
+                with open(os.path.join(testcase_dir, problem_id, test_file_name), 'r') as in_file:
+                    test_case_str = in_file.read()
+                testcases = []
+                for test_str in test_case_str.split(test_output_symbol):
+                    if test_str == '':
+                        continue
+                    test_input, test_output = test_str.split(test_input_symbol)
+                    testcases.append((test_input.encode(), test_output.encode()))
+
+            cases = []
+            for test_input, test_output in testcases:
+                in_offset = out_file.tell()
+                out_file.write(test_input)
+                out_offset = out_file.tell()
+                out_file.write(test_output)
+                cases.append([in_offset, len(test_input), out_offset, len(test_output)])
+            index.setdefault(problem_id, {})[judge_type] = {'source': test_file_name, 'size': size,
+                                                            'mtime_ns': mtime_ns, 'cases': cases}
+        index_data = json.dumps(index).encode()
+        index_offset = out_file.tell()
+        out_file.write(index_data)
+        out_file.write(struct.pack(footer_format, index_offset, len(index_data), index_magic))
+    if old_archive is not None:
+        old_archive.close()
+    os.replace(tmp_path, archive_path)
+    return num_reused, len(sources) - num_reused
@@ -0,0 +1,88 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from evals.testcase_archive import open_archive, archive_name
+
+# the calibrated time limits in the judge space, problem id -> cpu seconds (see evals/calibrate_time_limits.py)
+time_limits_name = 'time_limits.json'
+
+
+# keeps the testcases of the recently judged problems in memory,
+# so that constructing a Judge neither lists the testcase directory nor reopens the testcase files
+# the testcases of a problem are loaded lazily the first time they are needed
+# (from the testcase archive of the judge space if there is one, otherwise from the testcase files),
+# and the least recently used problems are dropped once more than max_problems are loaded
+class TestcaseRegistry:
+
+    def __init__(self, max_problems=64):
+        self.max_problems = max_problems
+        self.lock = threading.Lock()
+        # (judge space, problem id, judge type) -> list of (input bytes, expected output bytes)
+        self.testcases = OrderedDict()
+        # judge space -> opened archive
+        self.archives = {}
+        # judge space -> (mtime_ns of the time limits file, problem id -> time limit)
+        self.time_limits = {}
+
+    def get(self, judge_space_dir, problem_id, judge_type):
+        key = (judge_space_dir, problem_id, judge_type)
+        with self.lock:
+            if key in self.testcases:
+                self.testcases.move_to_end(key)
+                return self.testcases[key]
+        testcases = self.load(judge_space_dir, problem_id, judge_type)
+        with self.lock:
+            self.testcases[key] = testcases
+            self.testcases.move_to_end(key)
+            while len(self.testcases) > self.max_problems:
+                self.testcases.popitem(last=False)
+        return testcases
+
+    def get_archive(self, judge_space_dir):
+        archive_path = judge_space_dir + archive_name
+        with self.lock:
+            archive = self.archives.get(judge_space_dir)
+            try:
+                mtime_ns = os.stat(archive_path).st_mtime_ns
+            except FileNotFoundError:
+                return None
+            # reopen the archive if it has been rebuilt
+            if archive is None or archive.mtime_ns != mtime_ns:
+                archive = open_archive(archive_path)
+                self.archives[judge_space_dir] = archive
+            return archive
+
+    # the calibrated time limit of a problem, default if it has not been calibrated
+    def get_time_limit(self, judge_space_dir, problem_id, default=None):
+        time_limits_path = judge_space_dir + time_limits_name
+        with self.lock:
+            try:
+                mtime_ns = os.stat(time_limits_path).st_mtime_ns
+            except FileNotFoundError:
+                return default
+            # reload the time limits if they have been calibrated again
+            if self.time_limits.get(judge_space_dir, (None,))[0] != mtime_ns:
+                with open(time_limits_path, 'r') as in_file:
+                    self.time_limits[judge_space_dir] = (mtime_ns, json.load(in_file))
+            return self.time_limits[judge_space_dir][1].get(problem_id, default)
+
+    def load(self, judge_space_dir, problem_id, judge_type):
+        archive = self.get_archive(judge_space_dir)
+        if archive is not None and archive.has(problem_id, judge_type):
+            return archive.get(problem_id, judge_type)
+
+        test_cases_dir = '%s/%s/%s/' % (judge_space_dir, problem_id, judge_type)
+        num_test_cases = len(os.listdir(test_cases_dir)) // 2
+        testcases = []
+        for test_case_id in range(num_test_cases):
+            with open('%s%d.in' % (test_cases_dir, test_case_id), 'rb') as in_file:
+                test_input = in_file.read()
+            with open('%s%d.out' % (test_cases_dir, test_case_id), 'rb') as in_file:
+                test_output = in_file.read()
+            testcases.append((test_input, test_output))
+        return testcases
+
+
+# shared by all the judges of a process
+registry = TestcaseRegistry()
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import threading
+import socketserver
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from evals.gold_judge import Judge, compile_profiles, parse_cores
+from evals.compile_cache import CompileCache
+from evals.sandbox import SandboxPool, default_sandbox_dir
+
+# the judge daemon judges the candidates of all the search.py processes of a machine,
+# so that they share one compile cache, one testcase registry, one sandbox pool and one limit on the concurrent judges
+# instead of each process warming its own caches and over-subscribing the cpu
+# clients (see utils/judge_client.py) connect to a Unix socket and send one JSON request per line, each answered by a line
+#   {op: 'judge', jobs: [{job_id, problem_id, judge_type, code, eager, judge_id, case_failures}, ...]} -> {results}
+#       the jobs of a batch are judged concurrently, the results are in the order of the jobs,
+#       a job that raised (e.g. for an unknown problem) has the result {error} instead
+#   {op: 'cancel', job_ids} -> {}, the cancelled jobs report the status 'Cancelled'
+#   {op: 'progress'} -> {running, judged}
+default_socket = '../judge_space/judge.sock'
+# a cancellation of a job the daemon has not seen is forgotten after this many seconds,
+# it was either cancelled before it arrived (which takes much less) or had already finished
+cancel_ttl = 600
+
+
+class JudgeDaemon:
+
+    def __init__(self, concurrency=4, judge_kwargs=None):
+        self.judge_kwargs = {} if judge_kwargs is None else judge_kwargs
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.lock = threading.Lock()
+        # job id -> Judge of the jobs being judged
+        self.running = {}
+        # job id -> time of the cancellation, of the jobs cancelled before they started
+        self.cancelled = {}
+        self.num_judged = 0
+
+    # the error of a job is returned as its result, so that the other jobs of the batch are still answered
+    def judge_job(self, job):
+        try:
+            return self.judge_job_(job)
+        except Exception as e:
+            return {'error': repr(e)}
+
+    def judge_job_(self, job):
+        job_id = job['job_id']
+        judge = Judge(problem_id=job['problem_id'], judge_type=job.get('judge_type', 'all'),
+                      eager=job.get('eager', False), judge_id=job.get('judge_id'),
+                      case_failures={int(case_id): failures for case_id, failures in job.get('case_failures', {}).items()},
+                      **self.judge_kwargs)
+        with self.lock:
+            if self.cancelled.pop(job_id, None) is not None:
+                return {'Status': 'Cancelled'}
+            self.running[job_id] = judge
+        try:
+            return judge.judge_program_str(job['code'])
+        finally:
+            with self.lock:
+                del self.running[job_id]
+                self.num_judged += 1
+
+    def judge(self, request):
+        futures = [self.pool.submit(self.judge_job, job) for job in request['jobs']]
+        return {'results': [future.result() for future in futures]}
+
+    def cancel(self, request):
+        now = time.time()
+        with self.lock:
+            for job_id in request['job_ids']:
+                if job_id in self.running:
+                    self.running[job_id].cancel_running()
+                else:
+                    self.cancelled[job_id] = now
+            for job_id, cancel_time in list(self.cancelled.items()):
+                if cancel_time < now - cancel_ttl:
+                    del self.cancelled[job_id]
+        return {}
+
+    def progress(self, request=None):
+        with self.lock:
+            return {'running': len(self.running), 'judged': self.num_judged}
+
+    def handler(self):
+        routes = {'judge': self.judge, 'cancel': self.cancel, 'progress': self.progress}
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line.decode())
+                        response = routes[request['op']](request)
+                    except Exception as e:
+                        response = {'error': repr(e)}
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+                    self.wfile.flush()
+
+        return Handler
+
+    def serve(self, socket_path):
+        # a socket left by a daemon that did not shut down cleanly
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socketserver.ThreadingUnixStreamServer(socket_path, self.handler())
+        server.daemon_threads = True
+        print('judging on %s' % socket_path)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(socket_path)
+            self.pool.shutdown(wait=False)
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument('--socket', type=str, default=default_socket,
+                        help='the Unix socket the search processes connect to with --judge_socket.')
+    parser.add_argument('--concurrency', type=int, default=os.cpu_count(),
+                        help='maximum number of candidates judged at the same time, for all the search processes.')
+    parser.add_argument('--judge_workers', type=int, default=1,
+                        help='number of testcases of a candidate program that are run concurrently.')
+    parser.add_argument('--compile_profile', type=str, default='default',
+                        help='one of %s, see search.py.' % ', '.join(sorted(compile_profiles)))
+    parser.add_argument('--compile_cache_mb', type=int, default=0,
+                        help='size of the compile cache shared by all the search processes, 0 to disable it.')
+    parser.add_argument('--sandbox_dir', type=str, default=default_sandbox_dir,
+                        help='the RAM-backed directory holding one execution folder per concurrent judge.')
+    parser.add_argument('--cores', type=str, default=None,
+                        help='the cores the testcases are pinned to, e.g. 0-7.')
+    args = parser.parse_args()
+    if args.compile_profile not in compile_profiles:
+        parser.error('--compile_profile must be one of %s' % ', '.join(sorted(compile_profiles)))
+    return args
+
+
+if __name__ == '__main__':
+    args = get_args()
+    judge_kwargs = {'num_workers': args.judge_workers, 'compile_profile': args.compile_profile,
+                    'sandbox_pool': SandboxPool(args.sandbox_dir, num_slots=args.concurrency)}
+    if args.compile_cache_mb > 0:
+        judge_kwargs['compile_cache'] = CompileCache(max_bytes=args.compile_cache_mb * 1024 ** 2)
+    if args.cores is not None:
+        judge_kwargs['cores'] = parse_cores(args.cores)
+    JudgeDaemon(args.concurrency, judge_kwargs).serve(args.socket)
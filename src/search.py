@@ -1,18 +1,31 @@
 from utils.multi_best_pq import Multipq
 from utils.spoc_utils import kf_range
-from evals.gold_judge import Judge
+from utils.work_queue import WorkQueue, Heartbeat, default_owner, result_finished
+from utils.coordinator_client import CoordinatorClient, CoordinatorEvalStore
+from evals.gold_judge import Judge, compile_profiles, blame_result, parse_cores, get_failed_cases
+from evals.compile_cache import CompileCache
+from evals.eval_store import FileEvalStore, SqliteEvalStore
+from evals.sandbox import SandboxPool
+from utils.judge_client import JudgeClient
+from evals.cascade import Cascade, cascade_stages, pseudo_compile_opt
+from parse.pseudo_compiler import pseudo_compile_check
 from onmt_dir.prepare_for_onmt import round_trip
 from parse.program import Program_generator
 import os
 from argparse import ArgumentParser
 from search_util.structured_search import search_structured_groups
 from parse.misc import braces_acceptable
-import time
+import sys
+import random
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, List, Callable, Dict, Any
 import pickle as pkl
 
 translate_dir = '../spoc/pre_trans/'
 search_options = {'base', 'syntax', 'semantics'}
+memo_options = {'sqlite', 'files', 'pickle'}
 
 verbose = True
 
@@ -26,6 +39,108 @@ def translation_map(f_name: str) -> Tuple[List[List[str]], List[List[float]]]:
     return pkl.load(open('../spoc/pre_trans/' + f_name, 'rb'))
 
 
+# if the braces do not match (e.g. more '{' than '}' in the program), then reject directly
+def screen_braces(code):
+    if braces_acceptable(code):
+        return None
+    return {'Status': 'braces rejected', 'Stage': 'braces'}
+
+
+# screen code and judge it if it is not rejected, returns (result, whether it was judged)
+def screen_and_judge(screen, judge, code):
+    result = screen(code)
+    if result is not None:
+        return result, False
+    return judge.judge_program_str(code), True
+
+
+# judge the candidates generated by code_iter in rank order until one passes or the budget is used up
+# returns the list of (code, status) in rank order
+# screen returns a result for the candidates rejected before judging (see evals/cascade.py), None for the others
+# only the results of the judges are recorded, screen memoizes its own results
+# with window > 1 the next window candidates are screened and judged concurrently,
+# but the statuses are still committed in rank order, and the outstanding judges are cancelled
+# as soon as a candidate passes, so the result is the same as with window = 1
+# on_result (if not None) is called with the code and the result of every candidate screened or judged
+def judge_in_rank_order(code_iter, budget, lookup, record, make_judge, window=1, on_result=None, screen=screen_braces,
+                        skip=None):
+    statuses = []
+    if window <= 1:
+        for rank in range(budget):
+            code = next(code_iter)
+            if code is None:
+                break
+            status = lookup(code)
+            if status is None:
+                result, judged = screen_and_judge(screen, make_judge(rank), code)
+                status = result['Status']
+                if judged:
+                    record(code, status)
+                if on_result is not None:
+                    on_result(code, result)
+            statuses.append((code, status))
+            if status == 'Passed':
+                break
+        return statuses
+
+    # the candidates pulled but not committed yet, as (code, status), status is None while being judged
+    pending = deque()
+    # code -> (judge, future), the same code is only judged once
+    code2job, recorded = {}, set()
+    num_pulled, exhausted = 0, False
+    pool = ThreadPoolExecutor(max_workers=window)
+    while True:
+        # keep the window full
+        while not exhausted and len(pending) < window and len(statuses) + len(pending) < budget:
+            code = next(code_iter)
+            if code is None:
+                exhausted = True
+                break
+            status = lookup(code)
+            if status is None and code not in code2job:
+                judge = make_judge(num_pulled)
+                code2job[code] = (judge, pool.submit(screen_and_judge, screen, judge, code))
+            pending.append((code, status))
+            num_pulled += 1
+        if len(pending) == 0:
+            break
+
+        # commit the next candidate in rank order
+        code, status = pending.popleft()
+        # a candidate pulled before an earlier candidate was committed might have been skipped by code_iter since,
+        # it is dropped (and does not count towards the budget) so that the results are the same as with window=1
+        if skip is not None and skip(code):
+            job = code2job.get(code)
+            if job is not None and not job[1].done():
+                job[1].cancel()
+                job[0].cancel_running()
+            continue
+        if status is None:
+            result, judged = code2job[code][1].result()
+            status = result['Status']
+            if code not in recorded:
+                if judged:
+                    record(code, status)
+                recorded.add(code)
+                if on_result is not None:
+                    on_result(code, result)
+        statuses.append((code, status))
+        if status == 'Passed':
+            break
+
+    # cancel the outstanding judges, the results that are already available are still memoized
+    for code, (judge, future) in code2job.items():
+        if not future.done():
+            future.cancel()
+            judge.cancel_running()
+        elif code not in recorded and not future.cancelled() and future.exception() is None:
+            result, judged = future.result()
+            if judged and result['Status'] != 'Cancelled':
+                record(code, result['Status'])
+    pool.shutdown(wait=False)
+    return statuses
+
+
 def search(translation_map: Callable[[str], Tuple[List[List[str]], List[List[float]]]],  # see documentation above, generate code pieces and scores
            program_dict: Dict[str, Any],  # a dictionary that contains information needed for a program, including pseudo code, indent, etc
            result_dir: str,  # the directory to dump the results
@@ -33,14 +148,29 @@ def search(translation_map: Callable[[str], Tuple[List[List[str]], List[List[flo
            search_opt: str,  # the constraint we use for searching,
            structure_beam_size: int = 50,  # beam width W for the search
            structure_topk: int = 20,  # the top K scaffolds we use for the search
-           regular: bool = False  # whether to use hierarchical or regular beam search
+           recombine: bool = False,  # whether to merge the scaffold hypotheses with the same state
+           recombine_k_best: int = 1,  # the number of hypotheses kept for each state when recombining
+           regular: bool = False,  # whether to use hierarchical or regular beam search
+           judge_kwargs: Dict[str, Any] = None,  # extra keyword arguments for Judge, e.g. num_workers
+           eval_store=None,  # evaluation results shared by all the programs of a problem, see evals/eval_store.py
+           lock: bool = True,  # whether to dump a lock in the result path, not needed when the program is claimed from a WorkQueue
+           result_sink: Callable[[str, List[Dict[str, Any]], Dict[str, Any]], None] = None,
+           # called with (f_name, search results, search statistics) instead of dumping them into result_dir
+           speculative: int = 1,  # number of candidates judged concurrently, see judge_in_rank_order
+           blame: bool = False,  # whether to skip the candidates reusing a code piece blamed for a compilation error
+           cascade: List[str] = ('braces',),  # the stages that screen the candidates before judging, see evals/cascade.py
+           judge_client: JudgeClient = None  # judge on a judge daemon instead, see judge_daemon.py
            ):
+    if judge_kwargs is None:
+        judge_kwargs = {}
     # load program information
     f_name, indent = program_dict['f_name'], program_dict['indent']
     program_length = len(indent)
 
     # evaluation requires running on a lot of testcases and is time consuming
     # we memoize all the evaluation results and save it on the disk
+    # the legacy per-program pickle memo is still read if it exists,
+    # but with an eval_store each judgement is written to the store as soon as it completes
     memo_dir = '../spoc/eval_memo/' + f_name
     memo = {}
     if os.path.exists(memo_dir):
@@ -55,9 +185,12 @@ def search(translation_map: Callable[[str], Tuple[List[List[str]], List[List[flo
 
     # if the result path already exists, return
     # else dump a lock to indicate that currently this process is working on it
-    if os.path.exists(search_result_dir):
+    if lock:
+        if os.path.exists(search_result_dir):
+            return
+        pkl.dump('working', open(search_result_dir, 'wb'))
+    elif result_finished(search_result_dir):
         return
-    pkl.dump('working', open(search_result_dir, 'wb'))
     if verbose:
         print('searching for file %s.' % f_name)
 
@@ -76,7 +209,8 @@ def search(translation_map: Callable[[str], Tuple[List[List[str]], List[List[flo
     # search the scaffold
     if not regular:
         search_info = search_structured_groups(sents_l, scores_l, search_opt, indent,
-                                               beam_size=structure_beam_size, top_k=structure_topk)
+                                               beam_size=structure_beam_size, top_k=structure_topk,
+                                               recombine=recombine, k_best=recombine_k_best)
     else:
         search_info = search_structured_groups(sents_l, scores_l, search_opt, indent,
                                                beam_size=budget * 2, top_k=budget, use_code=True)
@@ -90,7 +224,10 @@ def search(translation_map: Callable[[str], Tuple[List[List[str]], List[List[flo
     groups = search_info['groups']
 
     if groups is None:
-        pkl.dump([], open(search_result_dir, 'wb'))
+        if result_sink is None:
+            pkl.dump([], open(search_result_dir, 'wb'))
+        else:
+            result_sink(f_name, [], None)
         return []
 
     # next_code returns an iterator that generates the next candidate
@@ -104,40 +241,97 @@ def search(translation_map: Callable[[str], Tuple[List[List[str]], List[List[flo
                 else:
                     yield None
     else:
+        mpq = Multipq(groups)
+        # the Candidate of each code pulled so far, to tell whether it was blamed after it was pulled
+        code2candidate = {}
+
         def next_code():
-            mpq = Multipq(groups)
             while True:
-                yield mpq.pop()
-
-    cur_idx = 0
-    return_val = []
-    code_iter = next_code()
-    while cur_idx < budget:
-        code = next(code_iter)
-        if code is None:
-            break
-        # check whether a piece of code has been evaluated in the history
-        # if yes, then directly load the result and hence avoid computation
-        if memo.get(code) is None:
-            # if the braces do not match (e.g. more '{' than '}' in the program), then reject directly
-            if braces_acceptable(code):
-                j = Judge(problem_id=pid, judge_type='all', eager=True, judge_id=f_name + str(cur_idx))
-                result = j.judge_program_str(code)
-                return_val.append({'rank': cur_idx, 'code': code, 'status': result['Status'], 'gold_pass': gold_passed})
-                memo[code] = result['Status']
-            else:
-                return_val.append({'rank': cur_idx, 'code': code, 'status': 'braces rejected', 'gold_pass': gold_passed})
-        else:
-            return_val.append({'rank': cur_idx, 'code': code, 'status': memo[code], 'gold_pass': gold_passed})
-        if code in memo and memo[code] == 'Passed':
-            break
+                candidate = mpq.pop_candidate()
+                if candidate is None:
+                    yield None
+                    continue
+                code = mpq.get_code(candidate)
+                code2candidate[code] = candidate
+                yield code
+
+    # the constraint of 'pseudo_compile' would reject the correct program if the gold program does not satisfy it
+    cascade = list(cascade)
+    if 'pseudo_compile' in cascade and not pseudo_compile_check('\n'.join(program_dict['program_by_line']), indent,
+                                                                pseudo_compile_opt):
+        cascade.remove('pseudo_compile')
+    rejection_cascade = Cascade(cascade, pid, indent, eval_store=eval_store,
+                                compile_profile=judge_kwargs.get('compile_profile', 'default'))
+
+    # the number of past failures on each testcase of the problem, the judges run the testcases failing the most first
+    case_failures = {} if eval_store is None else eval_store.get_case_failures(pid, 'all')
+
+    # when a candidate fails a testcase, count it for the later judges and in the store
+    # when a candidate does not compile and the error can be blamed on a single line
+    # skip every later candidate that uses the same code piece for that line
+    def on_result(code, result):
+        if 'Stage' not in result:
+            rejection_cascade.record_judgement(result)
+        if result['Status'] in ('Execution Error', 'TLE'):
+            failed_cases = get_failed_cases(result)
+            for case_id in failed_cases:
+                case_failures[case_id] = case_failures.get(case_id, 0) + 1
+            if eval_store is not None and len(failed_cases) > 0:
+                eval_store.add_case_failures(pid, 'all', failed_cases)
+        if not blame or regular or result['Status'] != 'Compilation Error':
+            return
+        code_by_line = code.split('\n')
+        if len(code_by_line) != program_length:
+            return
+        line_idx = blame_result(result, code_by_line)
+        if line_idx is not None:
+            mpq.blame(line_idx, code_by_line[line_idx])
+
+    # check whether a piece of code has been evaluated in the history
+    # if yes, then directly load the result and hence avoid computation
+    # the per-program memo is read first, then the store shared by all programs of the same problem
+    def lookup(code):
+        if memo.get(code) is None and eval_store is not None:
+            status = eval_store.get(pid, code)
+            if status is not None:
+                memo[code] = status
+        return memo.get(code)
+
+    def record(code, status):
+        memo[code] = status
+        if eval_store is not None:
+            eval_store.put(pid, code, status, f_name=f_name)
+
+    def make_judge(rank):
+        if judge_client is not None:
+            return judge_client.judge(pid, 'all', eager=True, judge_id=f_name + str(rank), case_failures=case_failures)
+        return Judge(problem_id=pid, judge_type='all', eager=True, judge_id=f_name + str(rank),
+                     case_failures=case_failures, **judge_kwargs)
+
+    # with speculative judging, skip the candidates pulled before one of their code pieces was blamed
+    def skip_blamed(code):
+        if not mpq.is_blamed(code2candidate[code]):
+            return False
+        mpq.num_skipped += 1
+        return True
 
-        cur_idx += 1
+    statuses = judge_in_rank_order(next_code(), budget, lookup, record, make_judge, window=speculative,
+                                   on_result=on_result, screen=rejection_cascade.screen,
+                                   skip=skip_blamed if blame and not regular else None)
+    search_info['cascade'] = rejection_cascade.stats
+    if not regular:
+        search_info['blame_skipped'] = mpq.num_skipped
+    return_val = [{'rank': rank, 'code': code, 'status': status, 'gold_pass': gold_passed}
+                  for rank, (code, status) in enumerate(statuses)]
 
     #  dump the search results and the memo
-    pkl.dump(return_val, open(search_result_dir, 'wb'))
-    pkl.dump(search_info, open(search_stats_result_dir, 'wb'))
-    pkl.dump(memo, open(memo_dir, 'wb'))
+    if result_sink is None:
+        pkl.dump(return_val, open(search_result_dir, 'wb'))
+        pkl.dump(search_info, open(search_stats_result_dir, 'wb'))
+    else:
+        result_sink(f_name, return_val, search_info)
+    if eval_store is None:
+        pkl.dump(memo, open(memo_dir, 'wb'))
     return return_val
 
 
@@ -151,7 +345,7 @@ def get_args():
     parser.add_argument('--target', type=str,
                         help='the dataset split for evaluation, worker/problem.')
     parser.add_argument('--seed', type=int, default=0,
-                        help='we randomly decide the order of evaluation.')
+                        help='we randomly decide the order in which the programs are added to the work queue.')
     parser.add_argument('--budget', type=int, default=100,
                         help='budget B in the paper.')
     parser.add_argument('--search_opt', type=str,
@@ -165,8 +359,68 @@ def get_args():
     parser.add_argument('--structure_topk', type=int, default=20,
                         help='the top k scaffold we keep for the subsequent search. '
                              'denoted by K in the paper. ')
+    parser.add_argument('--recombine', default=False, action='store_true',
+                        help='merge the scaffold hypotheses with the same scope stack and symbol tables, '
+                             'which have the same extensions, so that the beam keeps distinct ones.')
+    parser.add_argument('--recombine_k_best', type=int, default=1,
+                        help='with --recombine, the number of merged hypotheses kept for each state '
+                             'as candidate scaffolds.')
+    parser.add_argument('--judge_workers', type=int, default=1,
+                        help='number of testcases of a candidate program that are run concurrently. '
+                             'the first failing testcase cancels the rest.')
+    parser.add_argument('--compile_profile', type=str, default='default',
+                        help='default compiles each candidate with plain g++, '
+                             'pch reuses a precompiled header for the source header and compiles with -O0 -pipe.')
+    parser.add_argument('--compile_cache_mb', type=int, default=0,
+                        help='size bound (in MB) of the on-disk compile cache in ../spoc/compile_cache/, '
+                             'keyed by the token stream of a candidate. 0 to disable.')
+    parser.add_argument('--memo', type=str, default='sqlite',
+                        help='where the evaluation results are memoized. '
+                             'sqlite for the database ../spoc/eval_memo.db, '
+                             'files for one file per result in ../spoc/eval_store/, '
+                             'pickle for one pickle per program in ../spoc/eval_memo/. '
+                             'sqlite and files are shared among all the programs of the same problem.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of search processes to launch, '
+                             'they share the work queue in the result directory.')
+    parser.add_argument('--lease', type=int, default=600,
+                        help='seconds after which a program claimed by a worker that stopped sending heartbeats '
+                             'is handed out again.')
+    parser.add_argument('--coordinator', type=str, default=None,
+                        help='url of a coordinator (see coordinator.py), e.g. http://127.0.0.1:8765. '
+                             'the programs, the memo and the results then go through the coordinator '
+                             'instead of the local disk.')
+    parser.add_argument('--speculative', type=int, default=1,
+                        help='number of the next candidates that are judged concurrently. '
+                             'the results are the same as judging one at a time.')
+    parser.add_argument('--blame', default=False, action='store_true',
+                        help='when the compilation error of a candidate is local to one line, '
+                             'skip all the later candidates that use the same code piece for that line. '
+                             'only for hierarchical beam search.')
+    parser.add_argument('--sandbox_dir', type=str, default=None,
+                        help='a RAM-backed directory (e.g. /dev/shm/spoc_judge/) where a fixed pool of execution folders '
+                             'is created once, instead of creating an execution folder in the judge space per candidate.')
+    parser.add_argument('--cascade', type=str, default='braces',
+                        help='comma separated stages that screen the candidates before they are judged, from %s. '
+                             'see evals/cascade.py.' % ','.join(cascade_stages))
+    parser.add_argument('--judge_socket', type=str, default=None,
+                        help='the Unix socket of a judge daemon (judge_daemon.py) that judges the candidates, '
+                             'the judge options are then the ones of the daemon.')
+    parser.add_argument('--cores', type=str, default=None,
+                        help='the cores the testcases are pinned to, e.g. 0-7. with --workers, '
+                             'each worker gets its own share of the cores.')
 
     args = parser.parse_args()
+    args.cascade = [stage for stage in args.cascade.split(',') if stage != '']
+    for stage in args.cascade:
+        if stage not in cascade_stages:
+            parser.error('unknown cascade stage %s, the stages are %s' % (stage, ','.join(cascade_stages)))
+    if args.recombine_k_best < 1:
+        parser.error('--recombine_k_best must be at least 1')
+    if args.cores is not None:
+        cores = parse_cores(args.cores)
+        if len(cores) == 0 or not set(cores) <= os.sched_getaffinity(0):
+            parser.error('--cores must be a non-empty subset of the available cores %s' % sorted(os.sched_getaffinity(0)))
 
     if args.result_dir is None:
         model_result_dir = '../spoc/search_results/' + args.search_opt + '-'
@@ -174,6 +428,8 @@ def get_args():
         if not args.regular:
             model_result_dir += 'structure_beam_size%d' % args.structure_beam_size
             model_result_dir += 'structure_topk%d' % args.structure_topk
+            if args.recombine:
+                model_result_dir += 'recombine%d' % args.recombine_k_best
         model_result_dir += 'budget%d' % args.budget
         model_result_dir += '/'
         if not os.path.exists(model_result_dir):
@@ -185,20 +441,87 @@ if __name__ == '__main__':
     args = get_args()
     print(args)
 
-    # file range contains all the program id we want to evaluate
-    file_range = kf_range(args.target)
+    if args.workers > 1:
+        # launch the workers, the later --workers and --result_dir override the ones in sys.argv
+        worker_args = [sys.executable] + sys.argv + ['--workers=1', '--result_dir=' + args.result_dir]
+        if args.cores is None:
+            workers = [subprocess.Popen(worker_args) for _ in range(args.workers)]
+        else:
+            # split the cores among the workers, workers share cores only if there are more workers than cores
+            cores = parse_cores(args.cores)
+            workers = []
+            for worker_idx in range(args.workers):
+                worker_cores = cores[worker_idx % len(cores)::args.workers]
+                workers.append(subprocess.Popen(worker_args + ['--cores=' + ','.join(map(str, worker_cores))]))
+        for worker in workers:
+            worker.wait()
+        sys.exit(0)
 
-    # sometimes we are running several processes and we use randomness & time difference
-    # to avoid potential interference between processes
-    seed = args.seed + int(1000000 * time.time()) % 1000000
+    program_generator = Program_generator()
+    worker_id = default_owner()
+    result_sink = None
+    if args.coordinator is not None:
+        # the coordinator owns the work queue, the memo and the results
+        queue = CoordinatorClient(args.coordinator)
+        result_sink = queue.result_sink(worker_id)
+    else:
+        # file range contains all the program id we want to evaluate
+        file_range = kf_range(args.target)
 
-    # an iterator that yields program_dict, which is a dictionary that contains information about a program
-    pg = Program_generator().program_generator(all_info=True, shuffle=True, file_range=file_range, seed=seed)
+        # the programs are distributed to the processes through a work queue in the result directory
+        # each process adds the whole range in the same seeded random order (programs already queued are ignored)
+        # and claims one program at a time
+        if file_range is None:
+            file_range = program_generator.f_names
+        file_range = sorted(file_range)
+        random.Random(args.seed).shuffle(file_range)
+        queue = WorkQueue(args.result_dir + 'queue.db', lease_seconds=args.lease)
+        queue.add([f_name for f_name in file_range if not result_finished(args.result_dir + f_name + '.pkl')])
 
     assert args.search_opt in search_options
+    assert args.compile_profile in compile_profiles
+    assert args.memo in memo_options
 
-    for program_dict in pg:
-        search(translation_map, program_dict, result_dir=args.result_dir, budget=args.budget,
-               search_opt=args.search_opt,
-               structure_beam_size=args.structure_beam_size,
-               structure_topk=args.structure_topk, regular=args.regular)
+    judge_kwargs = {'num_workers': args.judge_workers, 'compile_profile': args.compile_profile}
+    judge_client = None
+    if args.judge_socket is not None:
+        # the daemon owns the compile cache, the sandbox and the cores
+        judge_client = JudgeClient(args.judge_socket)
+    else:
+        if args.compile_cache_mb > 0:
+            judge_kwargs['compile_cache'] = CompileCache(max_bytes=args.compile_cache_mb * 1024 ** 2)
+        if args.sandbox_dir is not None:
+            # one slot for each candidate judged at the same time
+            judge_kwargs['sandbox_pool'] = SandboxPool(args.sandbox_dir, num_slots=max(args.speculative, 1))
+        if args.cores is not None:
+            judge_kwargs['cores'] = parse_cores(args.cores)
+
+    eval_store = None
+    if args.coordinator is not None:
+        eval_store = CoordinatorEvalStore(queue)
+    elif args.memo == 'sqlite':
+        eval_store = SqliteEvalStore()
+    elif args.memo == 'files':
+        eval_store = FileEvalStore()
+
+    while True:
+        f_name = queue.claim(worker_id)
+        if f_name is None:
+            break
+        # program_dict is a dictionary that contains information about a program
+        program_dict = program_generator.indexed_program(program_generator.f_name2idx[f_name], all_info=True)
+        try:
+            with Heartbeat(queue, f_name, worker_id):
+                search(translation_map, program_dict, result_dir=args.result_dir, budget=args.budget,
+                       search_opt=args.search_opt,
+                       structure_beam_size=args.structure_beam_size,
+                       structure_topk=args.structure_topk, regular=args.regular,
+                       recombine=args.recombine, recombine_k_best=args.recombine_k_best,
+                       judge_kwargs=judge_kwargs, eval_store=eval_store, lock=False, result_sink=result_sink,
+                       speculative=args.speculative, blame=args.blame,
+                       cascade=args.cascade, judge_client=judge_client)
+        except Exception:
+            queue.release(f_name, worker_id)
+            raise
+        queue.complete(f_name, worker_id)
+    print(queue.progress())
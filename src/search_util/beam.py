@@ -1,17 +1,57 @@
-from copy import deepcopy
+from collections import namedtuple
 
+
+# an immutable list, append() returns a new History pointing to this one as its parent
+# the hypotheses extended from the same hypothesis share its history instead of copying it
+class History:
+
+    __slots__ = ('parent', 'value', 'length')
+
+    def __init__(self, parent=None, value=None):
+        self.parent, self.value = parent, value
+        self.length = 0 if parent is None else parent.length + 1
+
+    def append(self, value):
+        return History(self, value)
+
+    def __len__(self):
+        return self.length
+
+    def to_list(self):
+        values, node = [], self
+        while node.parent is not None:
+            values.append(node.value)
+            node = node.parent
+        return values[::-1]
+
+
+# a hypothesis merged into another one by recombination, extended along with it
+# the histories are the same as those of a candidate, table_history is None if the candidates do not keep one
+Alternative = namedtuple('Alternative', ['score', 'history', 'rank_history', 'score_history', 'table_history'])
+
+
+# the candidates implement can_accept(next_input), which returns None if next_input cannot extend the candidate
+# and otherwise a transition without modifying the candidate,
+# and apply(transition, score), which returns the extended candidate and is only called for the kept extensions
+# with recombine, the candidates with the same state_key() have the same extensions, so only the best one is kept
+# and the others are recorded by merge(other, k_best) as its Alternatives, which it extends with itself
+# the k_best - 1 best alternatives of every candidate are returned by fetch_candidates,
+# and their histories by get_tables and get_beam_histories, in the same order
 class Beam:
 
-    def __init__(self, topk, candidate_init, input2log_prob_l, test_mode=False):
+    def __init__(self, topk, candidate_init, input2log_prob_l, test_mode=False, recombine=False, k_best=1):
         self.candidates = [[candidate_init()]]
         self.topk = topk
         self.input2log_prob_l = input2log_prob_l
         self.test_mode = test_mode
+        self.recombine = recombine
+        self.k_best = k_best
         self.extend_count = 0
+        self.merge_count = 0
         self.search_success = self.search()
 
     def step(self, next_input_scores):
-        new_candidates = []
+        extensions = []
         cur_candidates = self.candidates[-1]
         next_input_scores = sorted(next_input_scores, key=lambda x: -x[1])
         extensions_made_per_candidate = [0 for _ in range(len(cur_candidates))]
@@ -23,20 +63,43 @@ class Beam:
             for candidate_idx, candidate in enumerate(cur_candidates):
                 if extensions_made_per_candidate[candidate_idx] >= self.topk:
                     continue
-                new_candidate = deepcopy(candidate)
-                step_accepted = new_candidate.step(next_input, score)
+                transition = candidate.can_accept(next_input)
                 self.extend_count += 1
-                if step_accepted:
-                    new_candidates.append(new_candidate)
+                if transition is not None:
+                    extensions.append((candidate.score + score, candidate, transition, score))
                     extensions_made_per_candidate[candidate_idx] += 1
                 elif self.test_mode:
                     print('searching fails with input ')
                     print(next_input)
-        new_candidates = sorted(new_candidates, key=lambda candidate: -candidate.score)[:self.topk]
+        extensions = sorted(extensions, key=lambda extension: -extension[0])
+        if not self.recombine:
+            new_candidates = [candidate.apply(transition, score)
+                              for _, candidate, transition, score in extensions[:self.topk]]
+        else:
+            new_candidates = self.recombine_extensions(extensions)
         for rank, candidate in enumerate(new_candidates):
-            candidate.rank_history.append(rank)
+            candidate.rank_history = candidate.rank_history.append(rank)
+            if len(candidate.alternatives) > 0:
+                candidate.alternatives = tuple(alternative._replace(rank_history=alternative.rank_history.append(rank))
+                                               for alternative in candidate.alternatives)
         self.candidates.append(new_candidates)
 
+    # the best topk extensions with distinct states, the ones merged while filling the beam become alternatives
+    def recombine_extensions(self, extensions):
+        state2candidate = {}
+        for _, candidate, transition, score in extensions:
+            new_candidate = candidate.apply(transition, score)
+            state_key = new_candidate.state_key()
+            if state_key in state2candidate:
+                state2candidate[state_key].merge(new_candidate, self.k_best)
+                self.merge_count += 1
+            else:
+                state2candidate[state_key] = new_candidate
+                if len(state2candidate) == self.topk:
+                    break
+        # dictionaries keep the insertion order, i.e. from the best score
+        return list(state2candidate.values())
+
     def search(self):
         for input2log_prob in self.input2log_prob_l:
             if type(input2log_prob) == dict:
@@ -45,15 +108,25 @@ class Beam:
         search_success = len(self.candidates[-1]) != 0
         return search_success
 
+    # the complete candidates and their alternatives, from the best score
+    def complete_hypotheses(self):
+        hypotheses = []
+        for candidate in self.candidates[-1]:
+            if candidate.complete:
+                hypotheses.append(candidate)
+                hypotheses += candidate.alternatives
+        return sorted(hypotheses, key=lambda hypothesis: -hypothesis.score)
+
     # the lower the score of the candidates the better
     def fetch_candidates(self):
-        return [(candidate.history, -candidate.score) for candidate in self.candidates[-1] if candidate.complete]
+        return [(hypothesis.history.to_list(), -hypothesis.score) for hypothesis in self.complete_hypotheses()]
 
     def get_tables(self):
-        return [candidate.table_history for candidate in self.candidates[-1] if candidate.complete]
+        return [hypothesis.table_history.to_list() for hypothesis in self.complete_hypotheses()]
 
     def get_beam_histories(self):
+        hypotheses = self.complete_hypotheses()
         return (
-            [candidate.rank_history for candidate in self.candidates[-1] if candidate.complete],
-            [candidate.score_history for candidate in self.candidates[-1] if candidate.complete]
+            [hypothesis.rank_history.to_list() for hypothesis in hypotheses],
+            [hypothesis.score_history.to_list() for hypothesis in hypotheses]
         )
\ No newline at end of file
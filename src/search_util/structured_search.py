@@ -3,7 +3,8 @@ from parse.type_line import type_line
 from utils.spoc_utils import freeze_config, unfreeze_config, normalize_scores
 from search_util.tables import increment_check
 import numpy as np
-from search_util.beam import Beam
+from search_util.beam import Beam, History, Alternative
+from utils.multi_best_pq import LazyGroup
 from typing import List, Union
 
 
@@ -151,19 +152,46 @@ def extract_semantics_config(sent, extra_info, typed):
     return config
 
 
+# a scope info is never modified once created, since the scope stacks are shared between hypotheses
+# replace() returns a modified copy
 class ScopeInfo:
 
     def __init__(self, scope_type, open_curly, potentially_complete):
         self.scope_type, self.open_curly, self.potentially_complete = scope_type, open_curly, potentially_complete
 
+    def replace(self, open_curly=None, potentially_complete=None):
+        return ScopeInfo(self.scope_type, self.open_curly if open_curly is None else open_curly,
+                         self.potentially_complete if potentially_complete is None else potentially_complete)
+
     def __repr__(self):
         return 'ScopeInfo: (' + self.scope_type + '; ' + 'open curly: ' + str(self.open_curly) \
                + '; potentially complete: ' + str(self.potentially_complete) + ')'
 
+
+# the index of the last scope opened by a curly brace, -1 if there is none
+def get_stack_top_brace_indent(scope_types):
+    stack_top_brace_indent = len(scope_types) - 1
+    while stack_top_brace_indent >= 0:
+        if scope_types[stack_top_brace_indent].open_curly:
+            break
+        stack_top_brace_indent -= 1
+    return stack_top_brace_indent
+
+
+# the scope stack with the scopes from start on marked as potentially complete
+def mark_potentially_complete(scope_types, start):
+    return scope_types[:start] + tuple(scope.replace(potentially_complete=True) for scope in scope_types[start:])
+
 class SearchError(Exception):
     pass
 
 
+# a hypothesis of the scaffold beam search
+# the hypotheses extended from the same one share its state: the histories are History objects,
+# the scope stack is a tuple of ScopeInfo and the symbol tables are only copied by increment_check when they change,
+# so copy() only copies the attributes
+# can_accept() checks an input without modifying the hypothesis and apply() creates the extended hypothesis,
+# so that the beam only creates the hypotheses of the extensions it keeps
 class StructureCandidate:
 
     def __init__(self, consider_scope=False, consider_table=False, table_typed=False, use_code=False):
@@ -175,32 +203,31 @@ class StructureCandidate:
             raise SearchError
         if not consider_scope and consider_table:
             raise SearchError
-        self.score, self.rank_history, self.history, self.score_history = 0, [], [], []
+        self.score, self.rank_history, self.history, self.score_history = 0, History(), History(), History()
         self.complete = False
         self.use_code = use_code
+        # the Alternatives merged into this hypothesis by the beam, see merge()
+        self.alternatives = ()
 
         # general properties of candidates
-        self.cur_indent_level, self.indentation_history = 0, []
+        self.cur_indent_level, self.indentation_history = 0, History()
 
         # build the variable table
         if self.consider_table:
             self.tables = [{}]
 
         if self.table_typed:
-            self.table_history = []
+            self.table_history = History()
 
         # variable keeping track of the scopes
         if self.consider_scope:
-            self.scope_types = []
+            self.scope_types = ()
             self.closed_scope_type = None
 
-    def stack_top_brace_indent(self):
-        stack_top_brace_indent = len(self.scope_types) - 1
-        while stack_top_brace_indent >= 0:
-            if self.scope_types[stack_top_brace_indent].open_curly:
-                break
-            stack_top_brace_indent -= 1
-        return stack_top_brace_indent
+    def copy(self):
+        new_candidate = StructureCandidate.__new__(StructureCandidate)
+        new_candidate.__dict__.update(self.__dict__)
+        return new_candidate
 
     def delete_unused_info(self, next_input):
         if self.consider_scope and not self.consider_table:
@@ -233,171 +260,205 @@ class StructureCandidate:
     Cannot parse goto statements.
     """
 
-    def step(self, next_input, score):
+    # checks whether the hypothesis can be extended by next_input without modifying it
+    # returns None if a constraint rejects next_input, otherwise the transition to pass to apply(), a dictionary of
+    #   'history': the entry of the history, 'indent': the indentation of the input (absent if scopes are not considered),
+    #   'state': the new values of the attributes the input changes
+    def can_accept(self, next_input):
         if self.use_code:
             code, next_input = next_input['code'], next_input['config']
         if type(next_input) == tuple:
             next_input = unfreeze_config(next_input)
         config = freeze_config(next_input)
+        transition = {'history': code if self.use_code else config, 'state': {}}
 
         next_input = self.delete_unused_info(next_input)
-        self.score += score
-        self.score_history.append(score)
 
         indent_this_input = None
         # ignore empty lines or line markers
         if next_input['line_type'] in ('empty', 'marker'):
-            self.indentation_history.append(indent_this_input)
-            if not self.use_code:
-                self.history.append(config)
-            else:
-                self.history.append(code)
-            if self.table_typed:
-                self.save_table()
-            return True
+            transition['indent'] = indent_this_input
+            return transition
 
+        cur_indent_level = self.cur_indent_level
         if self.consider_scope:
+            scope_types, closed_scope_type = self.scope_types, self.closed_scope_type
             open_new_scope = not next_input['line_complete']
             if next_input['start_w_close_curly']:
                 # close all the scopes up to the last open curly
-                stack_top_brace_indent = self.stack_top_brace_indent()
+                stack_top_brace_indent = get_stack_top_brace_indent(scope_types)
                 indent_this_input = stack_top_brace_indent
                 # reject if there is no brace on top of the stack
                 if stack_top_brace_indent < 0:
                     if debug:
                         print('nothing on top of the stack')
-                    return False
-                for _ in range(stack_top_brace_indent + 1, len(self.scope_types)):
-                    if not self.scope_types[_].potentially_complete:
+                    return None
+                for _ in range(stack_top_brace_indent + 1, len(scope_types)):
+                    if not scope_types[_].potentially_complete:
                         if debug:
                             print('closing non-potentially complete scopes above the stack top')
-                        return False
+                        return None
 
-                if len(self.scope_types) == 0:
+                if len(scope_types) == 0:
                     if debug:
                         print('scope list length 0')
-                    return False
+                    return None
                 # none acceptable closing of scopes
-                if next_input['line_type'] in ('else', 'else if') and self.scope_types[
+                if next_input['line_type'] in ('else', 'else if') and scope_types[
                     stack_top_brace_indent].scope_type not in ('if', 'else if'):
                     if debug:
                         print('else does not match')
-                    return False
+                    return None
 
-                if next_input['line_type'] == 'while' and self.scope_types[stack_top_brace_indent].scope_type != 'do':
-                    return False
+                if next_input['line_type'] == 'while' and scope_types[stack_top_brace_indent].scope_type != 'do':
+                    return None
 
                 # closing the previous scope if start with close curly
-                self.cur_indent_level = stack_top_brace_indent
-                self.closed_scope_type = self.scope_types[stack_top_brace_indent].scope_type
-                self.scope_types = self.scope_types[:stack_top_brace_indent]
+                cur_indent_level = stack_top_brace_indent
+                closed_scope_type = scope_types[stack_top_brace_indent].scope_type
+                scope_types = scope_types[:stack_top_brace_indent]
 
                 # since the statement is complete, anything up to the current
                 # open brace on top of the stack is potentially complete
-                stack_top_brace_indent = self.stack_top_brace_indent()
-                for idx in range(stack_top_brace_indent + 1, len(self.scope_types)):
-                    self.scope_types[idx].potentially_complete = True
+                stack_top_brace_indent = get_stack_top_brace_indent(scope_types)
+                scope_types = mark_potentially_complete(scope_types, stack_top_brace_indent + 1)
             # if other line type writes after the scope closing
             # then forget about the closed scope type information
             elif next_input['line_type'] not in ('else', 'else if'):
-                self.closed_scope_type = None
+                closed_scope_type = None
 
             # now close all potentially complete scopes unless there is a match for if-else
-            scope_clear_start = len(self.scope_types) - 1
+            scope_clear_start = len(scope_types) - 1
 
-            while scope_clear_start >= 0 and self.scope_types[scope_clear_start].potentially_complete:
+            while scope_clear_start >= 0 and scope_types[scope_clear_start].potentially_complete:
                 scope_clear_start -= 1
             scope_clear_start += 1
 
             if next_input['line_type'] in ('else', 'else if'):
-                if self.closed_scope_type in ('if', 'else if'):
-                    max_indent_match = self.cur_indent_level
+                if closed_scope_type in ('if', 'else if'):
+                    max_indent_match = cur_indent_level
                 else:
-                    max_indent_match = self.cur_indent_level - 1
+                    max_indent_match = cur_indent_level - 1
                     if max_indent_match < 0:
                         if debug:
                             print('Empty stack, nothing to match else scope')
-                        return False
-                    while self.scope_types[max_indent_match].scope_type not in ('if', 'else if') \
+                        return None
+                    while scope_types[max_indent_match].scope_type not in ('if', 'else if') \
                             and max_indent_match >= scope_clear_start:
-                        if not self.scope_types[max_indent_match].potentially_complete:
+                        if not scope_types[max_indent_match].potentially_complete:
                             print('else/else if closes a non potentially complete other type of scope')
-                            return False
+                            return None
                         max_indent_match -= 1
                     if max_indent_match < scope_clear_start:
                         if debug:
                             print('no matching previous if or else if')
-                        return False
-                self.cur_indent_level = max_indent_match
-                self.scope_types = self.scope_types[:self.cur_indent_level]
+                        return None
+                cur_indent_level = max_indent_match
+                scope_types = scope_types[:cur_indent_level]
 
             # if seeing another line type (e.g. for) that is contradictory to if, else if
             # then close all previous potentially complete scopes
             elif next_input['line_type'] not in ('close_curly_only', 'open_curly_only'):
-                self.scope_types = self.scope_types[:scope_clear_start]
-                self.cur_indent_level = scope_clear_start
+                scope_types = scope_types[:scope_clear_start]
+                cur_indent_level = scope_clear_start
 
-            if next_input['line_type'] == 'open_curly_only' and len(self.scope_types) > 0 and not self.scope_types[-1].open_curly:
-                indent_this_input = self.cur_indent_level - 1
-                self.scope_types[-1].open_curly = True
+            if next_input['line_type'] == 'open_curly_only' and len(scope_types) > 0 and not scope_types[-1].open_curly:
+                indent_this_input = cur_indent_level - 1
+                scope_types = scope_types[:-1] + (scope_types[-1].replace(open_curly=True),)
                 open_new_scope = False
 
             if indent_this_input is None:
-                indent_this_input = self.cur_indent_level
+                indent_this_input = cur_indent_level
 
             gold_indent = next_input.get('indent')
             # reject if the indentation is different from the gold one
             if gold_indent is not None and gold_indent != indent_this_input:
                 if debug:
                     print('indentation is wrong.')
-                return False
-            self.indentation_history.append(indent_this_input)
+                return None
+            transition['indent'] = indent_this_input
 
         if self.consider_table:
             atoms_declared, atoms_used, prototype = [next_input[key] for key in ['atoms_declared', 'atoms_used', 'prototype']]
-            search_success, self.tables = increment_check(tables=self.tables, indent=indent_this_input,
-                                                          atoms_declared=atoms_declared, atoms_used=atoms_used,
-                                                          prototype=prototype, typed=self.table_typed,
-                                                          debug=debug
-                                                          )
+            search_success, tables = increment_check(tables=self.tables, indent=indent_this_input,
+                                                     atoms_declared=atoms_declared, atoms_used=atoms_used,
+                                                     prototype=prototype, typed=self.table_typed,
+                                                     debug=debug
+                                                     )
             if not search_success:
                 if debug:
                     print('Variable constraint fails.')
-                return False
-
-        assert self.cur_indent_level == len(self.scope_types)
-
-        if self.table_typed:
-            self.save_table()
+                return None
+            transition['state']['tables'] = tables
 
         if self.consider_scope:
+            assert cur_indent_level == len(scope_types)
+
             # start a new scope
             if open_new_scope:
-                self.cur_indent_level += 1
-                self.scope_types.append(ScopeInfo(next_input['line_type'], next_input['end_w_open_curly'], False))
-                self.new_scope_opened = True
+                cur_indent_level += 1
+                scope_types = scope_types + (ScopeInfo(next_input['line_type'], next_input['end_w_open_curly'], False),)
+                new_scope_opened = True
             else:
-                self.new_scope_opened = False
+                new_scope_opened = False
 
             # mark all previous scopes without open curly as potentially complete
             # if no new scope is declared
-            if not self.new_scope_opened and next_input['line_complete']:
-                potential_complete_start = self.stack_top_brace_indent()
-                for _ in range(potential_complete_start + 1, len(self.scope_types)):
-                    self.scope_types[_].potentially_complete = True
-        if not self.use_code:
-            self.history.append(config)
-        else:
-            self.history.append(code)
-        self.complete = (self.cur_indent_level == 0)
-        return True
+            if not new_scope_opened and next_input['line_complete']:
+                potential_complete_start = get_stack_top_brace_indent(scope_types)
+                scope_types = mark_potentially_complete(scope_types, potential_complete_start + 1)
+            transition['state'].update(scope_types=scope_types, closed_scope_type=closed_scope_type,
+                                       new_scope_opened=new_scope_opened)
+        transition['state'].update(cur_indent_level=cur_indent_level, complete=(cur_indent_level == 0))
+        return transition
+
+    # the hypothesis extended by next_input with the transition returned by can_accept(next_input)
+    # this hypothesis is not modified, the new one shares its state
+    def apply(self, transition, score):
+        new_candidate = self.copy()
+        new_candidate.__dict__.update(transition['state'])
+        new_candidate.score = self.score + score
+        new_candidate.score_history = self.score_history.append(score)
+        if 'indent' in transition:
+            new_candidate.indentation_history = self.indentation_history.append(transition['indent'])
+        new_candidate.history = self.history.append(transition['history'])
+        if self.table_typed:
+            new_candidate.save_table()
+        # the alternatives have the same state, hence the same table
+        if len(self.alternatives) > 0:
+            new_candidate.alternatives = tuple(Alternative(
+                alternative.score + score, alternative.history.append(transition['history']),
+                alternative.rank_history, alternative.score_history.append(score),
+                None if not self.table_typed else alternative.table_history.append(new_candidate.table_history.value))
+                for alternative in self.alternatives)
+        return new_candidate
+
+    # the hypotheses with the same state accept the same inputs in the same way
+    # the histories and the score are not part of the state
+    def state_key(self):
+        state_key = (self.cur_indent_level, self.complete)
+        if self.consider_scope:
+            state_key += (self.closed_scope_type,
+                          tuple((scope.scope_type, scope.open_curly, scope.potentially_complete)
+                                for scope in self.scope_types))
+        if self.consider_table:
+            state_key += (tuple(frozenset(table.items()) for table in self.tables),)
+        return state_key
+
+    # record other, which has the same state and a lower score, and its alternatives as the alternatives of this one
+    # only the k_best - 1 best alternatives are kept
+    def merge(self, other, k_best):
+        merged = Alternative(other.score, other.history, other.rank_history, other.score_history,
+                             other.table_history if self.table_typed else None)
+        alternatives = self.alternatives + (merged,) + other.alternatives
+        self.alternatives = tuple(sorted(alternatives, key=lambda alternative: -alternative.score)[:k_best - 1])
 
     def save_table(self):
         var_table_this_line = {}
         for table in self.tables:
             for var_name in table:
                 var_table_this_line[var_name] = table[var_name]
-        self.table_history.append(var_table_this_line)
+        self.table_history = self.table_history.append(var_table_this_line)
 
 
 def search_structured_groups(sents_l: List[List[str]],  # L x C list of list
@@ -409,7 +470,9 @@ def search_structured_groups(sents_l: List[List[str]],  # L x C list of list
                              top_k=20,
                              beam_size=50,
                              use_code=False,
-                             structure_only=False
+                             structure_only=False,
+                             recombine=False,  # whether to merge the hypotheses with the same state, see beam.py
+                             k_best=1  # the number of hypotheses kept for each state when recombining
                              ):
     if not structure_only:
         program_length = len(sents_l)
@@ -473,7 +536,7 @@ def search_structured_groups(sents_l: List[List[str]],  # L x C list of list
     # to the log probability of the config
 
     # now we beam search over the configuration space
-    b = Beam(beam_size, candidate_init, config_logprobs_l)
+    b = Beam(beam_size, candidate_init, config_logprobs_l, recombine=recombine, k_best=k_best)
     if not structure_only:
         extend_amortized = float(b.extend_count) / program_length
     candidate_table_history = None
@@ -483,7 +546,8 @@ def search_structured_groups(sents_l: List[List[str]],  # L x C list of list
                 'groups': None,
                 'rejected_prob': rejected_mass,
                 'candidate_table_histories': candidate_table_history,
-                'extend_amortized': extend_amortized
+                'extend_amortized': extend_amortized,
+                'merge_count': b.merge_count
             }
         else:
             return {
@@ -508,27 +572,23 @@ def search_structured_groups(sents_l: List[List[str]],  # L x C list of list
     if use_code:
         return {'groups': ['\n'.join(candidate[0]) for candidate in candidates]}
 
-    groups = [([[] for _ in range(program_length)], [[] for _ in range(program_length)],
-               candidates[candidate_idx][1])
-              for candidate_idx in range(len(candidates))]
-
-    # group each line
-    # for each line
+    # for each line, group the code pieces by their configuration
+    # i.e. dictionary[config] = [<index of the code pieces that have this config>]
+    config2sent_idxes_l = []
     for line_idx in range(program_length):
-        config2group_idx = defaultdict(list)
-        # for each candidate config of that line, group them together
-        # i.e. dictionary[config] = [<candidate idx that have this config>]
-        for candidate_idx, (candidates_l, score) in enumerate(candidates):
-            if len(candidates_l) != program_length:
-                raise Exception
-            config2group_idx[candidates_l[line_idx]].append(candidate_idx)
-        # for each config in sents_l
-        # group the sentences to the corresponding config
-        for sent, config, score in zip(sents_l[line_idx], sent_configs_l[line_idx], scores_l[line_idx]):
-            group_idxes = config2group_idx[config]
-            for group_idx in group_idxes:
-                groups[group_idx][0][line_idx].append(sent)
-                groups[group_idx][1][line_idx].append(score)
+        config2sent_idxes = defaultdict(list)
+        for sent_idx, config in enumerate(sent_configs_l[line_idx]):
+            config2sent_idxes[config].append(sent_idx)
+        config2sent_idxes_l.append(config2sent_idxes)
+
+    # each scaffold only refers to the code pieces of its configuration for each line,
+    # the code pieces are copied when the scaffold is realized (see LazyGroup)
+    groups = []
+    for candidates_l, score in candidates:
+        if len(candidates_l) != program_length:
+            raise Exception
+        groups.append(LazyGroup(sents_l, scores_l, [config2sent_idxes_l[line_idx].get(candidates_l[line_idx], [])
+                                                    for line_idx in range(program_length)], score))
     return {
         'groups': groups,
         'rejected_prob': rejected_mass,
@@ -537,5 +597,6 @@ def search_structured_groups(sents_l: List[List[str]],  # L x C list of list
         'candidate_score_histories': candidate_score_history,
         'candidates': candidates,
         'candidate_table_histories': candidate_table_history,
-        'extend_amortized': extend_amortized
+        'extend_amortized': extend_amortized,
+        'merge_count': b.merge_count
     }
@@ -23,11 +23,14 @@ undeclared = {'cout', 'cin', 'endl', 'break', 'min', 'true', 'max', 'false', 'so
 def increment_check(tables, indent, atoms_declared, atoms_used, prototype, typed, debug=False):
     # tables is a list of dictionary, each of which is a symbol table for each scope level
     # a symbol table is a mapping from variable name to a boolean, True if it is a prototype
+    # tables is not modified since the hypotheses of the beam share it,
+    # a new list is returned and the symbol tables declaring a variable are copied the first time
     indent = int(indent)
     if len(tables) < indent + 2:
-        tables.append({})
+        tables = tables + [{}]
     else:
         tables = tables[:indent + 1] + [{}]
+    copied_levels = {indent + 1}
 
     # for every variable being declared
     for var_name, var_info in atoms_declared.items():
@@ -50,6 +53,9 @@ def increment_check(tables, indent, atoms_declared, atoms_used, prototype, typed
                     print('var %s declared.' % var_name)
                 return False, tables
         is_prototype = var_name == prototype
+        if indent + depth not in copied_levels:
+            tables[indent + depth] = dict(tables[indent + depth])
+            copied_levels.add(indent + depth)
         tables[indent + depth][var_name] = is_prototype if not typed else (var_type, is_prototype)
 
     # for every variable being used
@@ -0,0 +1,21 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from evals.cascade import Cascade
+from evals.eval_store import SqliteEvalStore
+from evals.gold_judge import blame_result
+
+program_by_line = ['int main() {', 'int a = 5 cout << a;', '}']
+
+
+# the second program of the problem finds the syntax error in the store, without the compiler message
+def test_memoized_syntax_error_is_not_blamed(tmp_path):
+    eval_store = SqliteEvalStore(str(tmp_path / 'memo.db'))
+    code = '\n'.join(program_by_line)
+    checked = Cascade(['syntax_only'], '0A', None, eval_store=eval_store).screen(code)
+    memoized = Cascade(['syntax_only'], '0A', None, eval_store=eval_store).screen(code)
+    assert checked['Status'] == memoized['Status'] == 'Compilation Error'
+    assert blame_result(checked, program_by_line) == 1
+    assert 'Error Message' not in memoized
+    assert blame_result(memoized, program_by_line) is None
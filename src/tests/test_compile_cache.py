@@ -0,0 +1,17 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from evals.compile_cache import code_hash
+
+
+def test_whitespace_is_ignored():
+    assert code_hash('int main() {\n  x = a / b;\n}') == code_hash('int main(){\nx=a/b ;\n}')
+    assert code_hash('cout << "a  b";') != code_hash('cout << "a b";')
+
+
+# the lexer has no comment tokens and lexes -> * and ->* the same
+def test_adjacent_operators_are_not_merged():
+    assert code_hash('x = a / /b;') != code_hash('x = a //b;')
+    assert code_hash('x = a/ *p;') != code_hash('x = a/*p;')
+    assert code_hash('x = p-> *q;') != code_hash('x = p->*q;')
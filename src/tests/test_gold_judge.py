@@ -0,0 +1,42 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from evals.gold_judge import blame_compile_error
+
+# compiler messages of g++ 12.2 for source_header followed by the program
+missing_semicolon_program = ['int main() {', 'int a = 5', 'cout << a;', '}']
+missing_semicolon_msg = ('source.cc: In function ‘int main()’:\n'
+                         'source.cc:7:1: error: expected ‘,’ or ‘;’ before ‘cout’\n'
+                         '    7 | cout << a;\n'
+                         '      | ^~~~\n')
+
+indented_missing_semicolon_program = ['int main() {', '\tint a = 5', '', '\tcout << a;', '}']
+indented_missing_semicolon_msg = ('source.cc: In function ‘int main()’:\n'
+                                  'source.cc:8:9: error: expected ‘,’ or ‘;’ before ‘cout’\n'
+                                  '    8 |         cout << a;\n'
+                                  '      |         ^~~~\n')
+
+same_line_program = ['int main() {', 'int a = 5 cout << a;', '}']
+same_line_msg = ('source.cc: In function ‘int main()’:\n'
+                 'source.cc:6:11: error: expected ‘,’ or ‘;’ before ‘cout’\n'
+                 '    6 | int a = 5 cout << a;\n'
+                 '      |           ^~~~\n')
+
+unclosed_paren_program = ['int main() {', 'int a = (5;', 'cout << a;', '}']
+unclosed_paren_msg = ('source.cc: In function ‘int main()’:\n'
+                      'source.cc:6:11: error: expected ‘)’ before ‘;’ token\n'
+                      '    6 | int a = (5;\n'
+                      '      |         ~ ^\n'
+                      '      |           )\n')
+
+
+# the missing ; is reported at the first token of the next line, which is correct code
+def test_missing_token_at_line_end_is_not_blamed():
+    assert blame_compile_error(missing_semicolon_msg, missing_semicolon_program) is None
+    assert blame_compile_error(indented_missing_semicolon_msg, indented_missing_semicolon_program) is None
+
+
+def test_error_inside_line_is_blamed():
+    assert blame_compile_error(same_line_msg, same_line_program) == 1
+    assert blame_compile_error(unclosed_paren_msg, unclosed_paren_program) == 1
@@ -0,0 +1,71 @@
+import json
+import pickle as pkl
+from base64 import b64encode
+from urllib.request import Request, urlopen
+
+
+# talks to a coordinator (see coordinator.py) on behalf of a search.py worker
+# it has the same interface as WorkQueue, so it can be used with Heartbeat
+class CoordinatorClient:
+
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.lease_seconds = self.progress()['lease_seconds']
+
+    def call(self, path, body=None):
+        data = None if body is None else json.dumps(body).encode()
+        request = Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        with urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode())
+
+    def claim(self, owner):
+        return self.call('/claim', {'owner': owner})['f_name']
+
+    def heartbeat(self, f_name, owner):
+        return self.call('/heartbeat', {'f_name': f_name, 'owner': owner})['ok']
+
+    def release(self, f_name, owner):
+        self.call('/release', {'f_name': f_name, 'owner': owner})
+
+    # the results are sent with complete(), so there is nothing left to do
+    def complete(self, f_name, owner):
+        pass
+
+    def progress(self):
+        return self.call('/progress')
+
+    # returns a result_sink for search() that sends the results of owner to the coordinator
+    def result_sink(self, owner):
+        def sink(f_name, return_val, search_info):
+            self.call('/complete', {'f_name': f_name, 'owner': owner,
+                                    'result': b64encode(pkl.dumps(return_val)).decode(),
+                                    'stats': None if search_info is None else b64encode(pkl.dumps(search_info)).decode()})
+        return sink
+
+
+# the memo kept by the coordinator, with the same interface as the stores in evals/eval_store.py
+class CoordinatorEvalStore:
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, pid, code):
+        return self.client.call('/memo/get', {'pid': pid, 'code': code})['status']
+
+    def put(self, pid, code, status, f_name=None):
+        self.client.call('/memo/put', {'pid': pid, 'code': code, 'status': status, 'f_name': f_name})
+
+    def get_stage(self, stage, pid, code):
+        return self.client.call('/stage/get', {'stage': stage, 'pid': pid, 'code': code})['status']
+
+    def put_stage(self, stage, pid, code, status):
+        self.client.call('/stage/put', {'stage': stage, 'pid': pid, 'code': code, 'status': status})
+
+    def get_case_failures(self, pid, judge_type):
+        case_failures = self.client.call('/stats/get', {'pid': pid, 'judge_type': judge_type})['case_failures']
+        # json object keys are strings
+        return {int(case_id): failures for case_id, failures in case_failures.items()}
+
+    def add_case_failures(self, pid, judge_type, case_ids):
+        self.client.call('/stats/add', {'pid': pid, 'judge_type': judge_type, 'case_ids': case_ids})
@@ -0,0 +1,74 @@
+import os
+import json
+import socket
+import itertools
+import threading
+
+
+# talks to a judge daemon (see judge_daemon.py) over its Unix socket
+# every request uses its own connection, so that the judges of several threads do not wait for each other
+class JudgeClient:
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.job_ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def call(self, request):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            with sock.makefile('rwb') as stream:
+                stream.write(json.dumps(request).encode() + b'\n')
+                stream.flush()
+                response = json.loads(stream.readline().decode())
+        if 'error' in response:
+            raise RuntimeError('judge daemon: %s' % response['error'])
+        return response
+
+    def new_job_id(self):
+        with self.lock:
+            return '%d-%d-%d' % (os.getpid(), threading.get_ident(), next(self.job_ids))
+
+    # jobs is a list of dictionaries with problem_id, code and optionally judge_type, eager, judge_id, case_failures
+    # returns the judge results in the same order, the result of a job that raised on the daemon is {error}
+    def judge_batch(self, jobs):
+        jobs = [dict(job, job_id=job.get('job_id') or self.new_job_id()) for job in jobs]
+        return self.call({'op': 'judge', 'jobs': jobs})['results']
+
+    def cancel(self, job_ids):
+        self.call({'op': 'cancel', 'job_ids': job_ids})
+
+    def progress(self):
+        return self.call({'op': 'progress'})
+
+    # a judge for one problem with the same interface as Judge in evals/gold_judge.py
+    def judge(self, problem_id, judge_type, eager=False, judge_id=None, case_failures=None):
+        return RemoteJudge(self, problem_id, judge_type, eager=eager, judge_id=judge_id, case_failures=case_failures)
+
+
+# judges a program on the daemon, it can be used in place of a Judge in search.py
+class RemoteJudge:
+
+    def __init__(self, client, problem_id, judge_type, eager=False, judge_id=None, case_failures=None):
+        self.client = client
+        self.job = {'problem_id': problem_id, 'judge_type': judge_type, 'eager': eager, 'judge_id': judge_id,
+                    'case_failures': {} if case_failures is None else dict(case_failures)}
+        self.job_id = client.new_job_id()
+        self.sent = False
+
+    def judge_program_str(self, program_str):
+        self.sent = True
+        result = self.client.judge_batch([dict(self.job, job_id=self.job_id, code=program_str)])[0]
+        if 'error' in result:
+            raise RuntimeError('judge daemon: %s' % result['error'])
+        return result
+
+    # cancel the program being judged, it then reports 'Cancelled'
+    # the daemon also remembers the cancellation of a job it has not received yet
+    def cancel_running(self, futures=()):
+        for future in futures:
+            future.cancel()
+        if self.sent:
+            self.client.cancel([self.job_id])
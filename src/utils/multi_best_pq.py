@@ -1,7 +1,60 @@
 import numpy as np
 import heapq
+from collections import namedtuple
+
+# a popped candidate: the index of its group (scaffold), the candidate index of each line within the group,
+# and its score (the key it was popped with); its code is only built by Multipq.get_code
+Candidate = namedtuple('Candidate', ['group_id', 'config', 'score'])
+
+# the code pieces of a scaffold (see search_structured_groups):
+# for each line, the indexes of the code pieces in sents_l/scores_l whose configuration matches the scaffold
+# the index lists are shared by all the scaffolds with the same configuration for a line,
+# and the lists of code pieces and scores of the scaffold are only built when it is realized
+# it can be used as the tuple (sents_l, scores_l, base_score) of the scaffold
+class LazyGroup:
+
+    def __init__(self, sents_l, scores_l, idxes_l, base_score):
+        self.all_sents_l, self.all_scores_l = sents_l, scores_l
+        self.idxes_l = idxes_l
+        self.base_score = base_score
+        self.realized = None
+
+    def realize(self):
+        if self.realized is None:
+            self.realized = ([[sents[idx] for idx in idxes] for sents, idxes in zip(self.all_sents_l, self.idxes_l)],
+                             [[scores[idx] for idx in idxes] for scores, idxes in zip(self.all_scores_l, self.idxes_l)])
+        return self.realized
+
+    # the score of the best configuration (the same as PQ.peek_score before any pop), without realizing the group
+    def first_score(self, use_base_score=False):
+        for idxes in self.idxes_l:
+            if len(idxes) == 0:
+                return float('inf')
+        score = np.sum([scores[idxes[0]] for scores, idxes in zip(self.all_scores_l, self.idxes_l)])
+        return score + (0 if not use_base_score else self.base_score)
+
+    def size(self):
+        size = 1
+        for idxes in self.idxes_l:
+            size *= len(idxes)
+        return size
+
+    def __getitem__(self, idx):
+        if idx in (2, -1):
+            return self.base_score
+        return self.realize()[idx]
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        return iter(self.realize() + (self.base_score,))
+
 
 # smaller scores are better
+# the priority queues are merged through a heap of (next score, priority queue index),
+# so a pop costs O(log K) for K priority queues; ties go to the priority queue with the lower index
+# the priority queue of a LazyGroup is only built when it is popped for the first time
 class Multipq:
 
     def __init__(self, groups, use_base_score=False):
@@ -9,40 +62,115 @@ class Multipq:
         self.last_popped_pq_id = None
         self.pqs = []
         self.use_base_score = use_base_score
-        for group in self.groups:
-            sents_l, scores_l, base_score = group
-            self.pqs.append(PQ(sents_l, scores_l, base_score, self.use_base_score))
-        self.size = sum([pq.size for pq in self.pqs])
+        self.size = 0
+        self.num_skipped = 0
+        # the code pieces blamed so far, as (line index, code piece), applied to the priority queues built later
+        self.blamed = []
+        # the next score of a priority queue only changes when it is popped
+        self.heap = []
+        for pq_idx, group in enumerate(self.groups):
+            if isinstance(group, LazyGroup):
+                self.pqs.append(None)
+                self.size += group.size()
+                first_score = group.first_score(self.use_base_score)
+                if first_score < float('inf'):
+                    heapq.heappush(self.heap, (first_score, pq_idx))
+            else:
+                sents_l, scores_l, base_score = group
+                self.pqs.append(PQ(sents_l, scores_l, base_score, self.use_base_score))
+                self.size += self.pqs[-1].size
+                self.push_pq(pq_idx)
+
+    def get_pq(self, pq_idx):
+        if self.pqs[pq_idx] is None:
+            sents_l, scores_l, base_score = self.groups[pq_idx]
+            pq = PQ(sents_l, scores_l, base_score, self.use_base_score)
+            for line_idx, sent in self.blamed:
+                pq.blame(line_idx, sent)
+            self.pqs[pq_idx] = pq
+        return self.pqs[pq_idx]
+
+    # the priority queues that are exhausted are left out
+    def push_pq(self, pq_idx):
+        next_score = self.pqs[pq_idx].peek_score()
+        if next_score < float('inf'):
+            heapq.heappush(self.heap, (next_score, pq_idx))
+
+    # the next Candidate in rank order, None if all the candidates have been popped
+    def pop_candidate(self):
+        while True:
+            # pop the priority queue with the lowest score
+            if len(self.heap) == 0:
+                return None
+            score, min_pq_id = heapq.heappop(self.heap)
+            pq = self.get_pq(min_pq_id)
+            config = pq.pop_config()
+            self.push_pq(min_pq_id)
+            # skip the configurations that contain a blamed code piece
+            if pq.is_blamed(config):
+                self.num_skipped += 1
+                continue
+            self.last_popped_pq_id = min_pq_id
+            return Candidate(min_pq_id, config, score)
+
+    # the next n candidates in rank order (fewer if the candidates run out), the same as n calls of pop
+    # but without joining the code of the candidates
+    def pop_many(self, n):
+        candidates = []
+        while len(candidates) < n:
+            candidate = self.pop_candidate()
+            if candidate is None:
+                break
+            candidates.append(candidate)
+        return candidates
+
+    def get_code(self, candidate):
+        return self.pqs[candidate.group_id].get_code(candidate.config)
 
     def pop(self):
-        # peek each priority queue and decide which to pop
-        min_score, min_pq_id = np.float('inf'), None
-        for next_pq_idx, pq in enumerate(self.pqs):
-            next_score = pq.peek_score()
-            if next_score < min_score:
-                min_score, min_pq_id = next_score,  next_pq_idx
-
-        # pop the priority queue with the lowest score
-        if min_pq_id is None:
+        candidate = self.pop_candidate()
+        if candidate is None:
             return None
-        self.last_popped_pq_id = min_pq_id
-        code = self.pqs[min_pq_id].pop()
-        return code
+        return self.get_code(candidate)
+
+    # whether a popped Candidate contains a code piece blamed since it was popped
+    def is_blamed(self, candidate):
+        return self.pqs[candidate.group_id].is_blamed(candidate.config)
 
+    # blame the code piece sent for line line_idx (e.g. it causes a compilation error)
+    # every configuration that uses it for this line will be skipped
+    def blame(self, line_idx, sent):
+        self.blamed.append((line_idx, sent))
+        for pq in self.pqs:
+            if pq is not None:
+                pq.blame(line_idx, sent)
+
+# enumerates the configurations (a candidate index for each line) from the lowest score
+# the scores of the candidates of each line are sorted, so increasing the candidate index of a line never decreases the score
+# the configurations in the heap are packed into integers in mixed radix (the candidate index of line 0 is the most
+# significant digit), so comparing two packed configurations is the same as comparing them as tuples
+# every configuration is pushed exactly once: it only generates the configurations that increase
+# the last line that is not at its first candidate, or a later line (Lawler's canonical successors),
+# so no set of the configurations already generated is needed
 class PQ:
 
     def __init__(self, sents_l, scores_l, base_score, use_base_score=False):
         self.sents_l, self.scores_l = sents_l, scores_l
         self.use_base_score = use_base_score
         self.length = len(self.sents_l)
+        self.num_candidates = [len(sents) for sents in self.sents_l]
+        # the value of one candidate index step of each line in a packed configuration
+        self.weights = [1] * self.length
+        for idx in range(self.length - 2, -1, -1):
+            self.weights[idx] = self.weights[idx + 1] * self.num_candidates[idx + 1]
         if not self.check_empty():
-            self.heap = [(np.sum([scores[0] for scores in scores_l]), tuple([0] * self.length))]
-            self.accessed = set(self.heap[0][1])
+            self.heap = [(np.sum([scores[0] for scores in scores_l]), 0)]
         else:
             self.heap = []
-            self.accessed = set()
         self.base_score = base_score
         self.get_self_size()
+        # line index -> the set of blamed candidate indexes for that line
+        self.blamed = {}
 
     def get_self_size(self):
         self.size = 1
@@ -53,7 +181,7 @@ class PQ:
     def peek_score(self):
         if not self.is_empty():
             return self.heap[0][0] + (0 if not self.use_base_score else self.base_score)
-        return np.float('inf')
+        return float('inf')
 
     def check_empty(self):
         for sents in self.sents_l:
@@ -64,24 +192,43 @@ class PQ:
     def next_candidate_score(self):
         return self.peek_score()
 
-    def pop(self):
-        candidate = heapq.heappop(self.heap)
-        score, config = candidate
-        for mod_idx in range(self.length):
-            mod_num_candidates = len(self.sents_l[mod_idx])
-            if config[mod_idx] >= mod_num_candidates:
-                continue
-            new_config = tuple([config[i] if i != mod_idx else config[i] + 1 for i in range(self.length)])
-            if new_config in self.accessed:
-                continue
-            self.accessed.add(new_config)
-            if new_config[mod_idx] >= mod_num_candidates:
-                continue
+    def unpack(self, packed):
+        config = []
+        for weight in self.weights:
+            candidate_idx, packed = divmod(packed, weight)
+            config.append(candidate_idx)
+        return tuple(config)
 
+    # pop the configuration with the lowest score and push its canonical successors
+    def pop_config(self):
+        score, packed = heapq.heappop(self.heap)
+        config = self.unpack(packed)
+        last_idx = self.length - 1
+        while last_idx > 0 and config[last_idx] == 0:
+            last_idx -= 1
+        for mod_idx in range(last_idx, self.length):
+            if config[mod_idx] + 1 >= self.num_candidates[mod_idx]:
+                continue
             new_score = score + self.scores_l[mod_idx][config[mod_idx] + 1] - self.scores_l[mod_idx][config[mod_idx]]
-            heapq.heappush(self.heap, (new_score, new_config))
-        code = '\n'.join([self.sents_l[idx][config[idx]] for idx in range(self.length)])
-        return code
+            heapq.heappush(self.heap, (new_score, packed + self.weights[mod_idx]))
+        return config
+
+    def get_code(self, config):
+        return '\n'.join([self.sents_l[idx][config[idx]] for idx in range(self.length)])
+
+    def pop(self):
+        return self.get_code(self.pop_config())
+
+    def blame(self, line_idx, sent):
+        for candidate_idx, candidate_sent in enumerate(self.sents_l[line_idx]):
+            if candidate_sent == sent:
+                self.blamed.setdefault(line_idx, set()).add(candidate_idx)
+
+    def is_blamed(self, config):
+        for line_idx, candidate_idxes in self.blamed.items():
+            if config[line_idx] in candidate_idxes:
+                return True
+        return False
 
     def is_empty(self):
         return len(self.heap) == 0
\ No newline at end of file
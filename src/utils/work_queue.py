@@ -0,0 +1,126 @@
+import os
+import time
+import socket
+import sqlite3
+import threading
+import pickle as pkl
+
+pending, claimed, done, failed = 'pending', 'claimed', 'done', 'failed'
+
+
+# whether the search result of a program has been dumped (rather than a lock or nothing)
+def result_finished(search_result_dir):
+    if not os.path.exists(search_result_dir):
+        return False
+    try:
+        return type(pkl.load(open(search_result_dir, 'rb'))) != str
+    except (EOFError, pkl.UnpicklingError):
+        return False
+
+
+def default_owner():
+    return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+# a queue of programs (f_names) to search, shared by all the worker processes through an SQLite database
+# a worker atomically claims a program and holds a lease on it, which it renews with heartbeats
+# if a worker crashes its lease expires and the program is handed out again
+# a program whose lease has expired max_attempts times is marked as failed
+class WorkQueue:
+
+    def __init__(self, db_dir, lease_seconds=600, max_attempts=3, timeout=60):
+        self.lease_seconds, self.max_attempts = lease_seconds, max_attempts
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_dir, timeout=timeout, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                              'f_name TEXT PRIMARY KEY, seq INTEGER NOT NULL, state TEXT NOT NULL, '
+                              'owner TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, seq)')
+
+    # add the programs in order, the ones already in the queue are ignored
+    def add(self, f_names):
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                start = self.conn.execute('SELECT COALESCE(MAX(seq) + 1, 0) FROM tasks').fetchone()[0]
+                self.conn.executemany('INSERT OR IGNORE INTO tasks (f_name, seq, state) VALUES (?, ?, ?)',
+                                      [(f_name, start + idx, pending) for idx, f_name in enumerate(f_names)])
+                self.conn.execute('COMMIT')
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    # returns the next program to work on and leases it to owner, None if there is nothing left
+    def claim(self, owner):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                # abandoned programs that were already tried too many times are given up
+                self.conn.execute('UPDATE tasks SET state = ? WHERE state = ? AND lease_expires < ? AND attempts >= ?',
+                                  (failed, claimed, now, self.max_attempts))
+                row = self.conn.execute('SELECT f_name FROM tasks '
+                                        'WHERE state = ? OR (state = ? AND lease_expires < ?) '
+                                        'ORDER BY seq LIMIT 1', (pending, claimed, now)).fetchone()
+                if row is not None:
+                    self.conn.execute('UPDATE tasks SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 '
+                                      'WHERE f_name = ?', (claimed, owner, now + self.lease_seconds, row[0]))
+                self.conn.execute('COMMIT')
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+        return None if row is None else row[0]
+
+    # renew the lease, returns False if the lease has been lost to another worker
+    def heartbeat(self, f_name, owner):
+        with self.lock:
+            cursor = self.conn.execute('UPDATE tasks SET lease_expires = ? WHERE f_name = ? AND owner = ? AND state = ?',
+                                       (time.time() + self.lease_seconds, f_name, owner, claimed))
+        return cursor.rowcount == 1
+
+    def complete(self, f_name, owner):
+        with self.lock:
+            self.conn.execute('UPDATE tasks SET state = ?, lease_expires = NULL WHERE f_name = ? AND owner = ?',
+                              (done, f_name, owner))
+
+    # give the program back to the queue, e.g. when the search raised an exception
+    def release(self, f_name, owner):
+        with self.lock:
+            self.conn.execute('UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+                              'owner = NULL, lease_expires = NULL WHERE f_name = ? AND owner = ? AND state = ?',
+                              (self.max_attempts, failed, pending, f_name, owner, claimed))
+
+    # number of programs in each state
+    def progress(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall()
+        return {state: count for state, count in rows}
+
+    def close(self):
+        self.conn.close()
+
+
+# renews the lease on a program in a background thread while the program is being searched
+class Heartbeat:
+
+    def __init__(self, queue, f_name, owner, interval=None):
+        self.queue, self.f_name, self.owner = queue, f_name, owner
+        self.interval = interval if interval is not None else queue.lease_seconds / 3
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.queue.heartbeat(self.f_name, self.owner):
+                print('lost the lease on %s.' % self.f_name)
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()